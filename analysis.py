@@ -0,0 +1,91 @@
+import asyncio
+
+from starlette.background import BackgroundTasks
+
+from logger import logger
+from metrics import stage, request_trace
+from serp_cache import serp_cache
+from utils import process_search_results, yandex_xmlproxy_request, google_proxy_request, SharedFetches
+
+YANDEX = "yandex"
+GOOGLE = "google"
+
+
+def format_response(decrease_qty, filtered_urls, increase_qty, lsi, url) -> dict:
+    """Формирует ответ API по результатам анализа страницы."""
+    return {"status": "success",
+            'lsi': [key for key in lsi.keys()] if not lsi.empty else [],
+            'увеличить частотность': [f"{key}: {value}" for key, value in
+                                      increase_qty.items()] if not increase_qty.empty else [],
+            'уменьшить частотность': [f"{key}: {value}" for key, value in
+                                      decrease_qty.items()] if not decrease_qty.empty else [],
+            'обработанные ссылки': {i: page_url for i, page_url in filtered_urls.items() if page_url != url}
+            }
+
+
+async def get_search_results(database, db_request, provider: str):
+    """Получает выдачу для сохранённого запроса через кэш выдачи."""
+    search_string = db_request.search_string
+    region = db_request.region
+    domain = db_request.domain
+    if provider == GOOGLE:
+        fetch = lambda: google_proxy_request(search_string=search_string, location=region, domain=domain)  # noqa: E731
+    else:
+        fetch = lambda: yandex_xmlproxy_request(search_string=search_string, region=region)  # noqa: E731
+    with stage("serp"):
+        return await serp_cache.get((search_string, region, domain), fetch, database)
+
+
+async def analyze_request(database, background_tasks, db_request, provider: str,
+                          shared_fetches: SharedFetches = None) -> dict:
+    """Выполняет полный анализ сохранённого запроса и возвращает ответ API."""
+    with request_trace(provider, db_request.id):
+        search_results, serp_cached = await get_search_results(database, db_request, provider)
+        if search_results is None:
+            raise RuntimeError("Search results are not available")
+        decrease_qty, filtered_urls, increase_qty, lsi = await process_search_results(background_tasks, database,
+                                                                                      db_request, search_results,
+                                                                                      db_request.url, serp_cached,
+                                                                                      shared_fetches)
+        return format_response(decrease_qty, filtered_urls, increase_qty, lsi, db_request.url)
+
+
+async def analyze_batch(database, items: list, concurrency: int):
+    """Анализирует пакет (url, search_string, region) и отдаёт результаты по мере готовности.
+
+    Одинаковые запросы выдачи объединяет кэш выдачи, одинаковые тексты — лемматизация;
+    страницы, общие для нескольких одновременно анализируемых элементов, загружаются один раз.
+    Результаты каждого элемента сохраняются сразу после его анализа, а не в конце пакета.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    shared_fetches = SharedFetches()
+
+    async def run_item(index, item):
+        background_tasks = BackgroundTasks()
+        async with semaphore:
+            try:
+                db_request = await database.save_request(item['url'], item['search_string'], item['region'], '')
+                result = await analyze_request(database, background_tasks, db_request, YANDEX, shared_fetches)
+                item_result = {"index": index, "url": item['url'], "search_string": item['search_string'],
+                               "region": item['region'], "result": result}
+            except Exception as e:
+                logger.error(f"Error processing batch item {index}: {e}")
+                return {"index": index, "url": item['url'], "search_string": item['search_string'],
+                        "region": item['region'], "error": str(e)}
+        # Сохранение не прерывается, если клиент отключился, пока оно идёт
+        try:
+            await asyncio.shield(background_tasks())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error saving batch item {index}: {e}")
+        return item_result
+
+    tasks = [asyncio.create_task(run_item(index, item)) for index, item in enumerate(items)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+        logger.info(f"Batch finished: {len(items)} items, {shared_fetches.started} shared page fetches")
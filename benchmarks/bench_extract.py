@@ -0,0 +1,72 @@
+"""Сравнение извлечения текста: lxml по частям против прежнего BeautifulSoup(html.parser).
+
+Корпус — каталог с сохранёнными страницами (*.html):
+
+    python benchmarks/bench_extract.py --corpus corpus/html --runs 3
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_extract import CHUNK_SIZE, extract_text, _extract_with_bs4, _detect_encoding  # noqa: E402
+
+
+def legacy_extract(chunks, encoding):
+    page_content = _extract_with_bs4(chunks, _detect_encoding(chunks, encoding)).strip()
+    return re.sub(r"\s+", " ", page_content)
+
+
+def load_corpus(path):
+    pages = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(path, name), "rb") as f:
+                data = f.read()
+            pages.append([data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)])
+    return pages
+
+
+def measure(func, pages, runs):
+    started = time.perf_counter()
+    for _ in range(runs):
+        results = [func(chunks, None) for chunks in pages]
+    return (time.perf_counter() - started) / runs, results
+
+
+def similarity(left, right):
+    # Доля общих слов: порядок текста не важен для частотного анализа
+    left, right = Counter(left.split()), Counter(right.split())
+    total = max(sum(left.values()), sum(right.values()))
+    return sum((left & right).values()) / total if total else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", required=True, help="каталог с HTML-страницами")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus)
+    if not pages:
+        parser.error("в каталоге нет HTML-страниц")
+    size = sum(len(chunk) for chunks in pages for chunk in chunks)
+
+    legacy_time, legacy = measure(legacy_extract, pages, args.runs)
+    lxml_time, extracted = measure(extract_text, pages, args.runs)
+    scores = sorted(similarity(left, right) for left, right in zip(legacy, extracted))
+
+    print(f"Страниц: {len(pages)}, объём: {size / 2 ** 20:.1f} МБ")
+    print(f"BeautifulSoup: {legacy_time:.2f} с, {len(pages) / legacy_time:.1f} стр/с, "
+          f"{size / 2 ** 20 / legacy_time:.1f} МБ/с")
+    print(f"lxml:          {lxml_time:.2f} с, {len(pages) / lxml_time:.1f} стр/с, "
+          f"{size / 2 ** 20 / lxml_time:.1f} МБ/с")
+    print(f"Совпадение слов: медиана {scores[len(scores) // 2]:.3f}, минимум {scores[0]:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Сравнение расчёта частот на NumPy с прежним путём Counter → DataFrame.
+
+Проверяет совпадение результатов на синтетических выдачах и измеряет время и пиковую память:
+
+    python benchmarks/bench_frequency.py --docs 30 --vocabulary 40000 --doc-length 5000 --runs 20
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+import pandas as pd
+from numpy import ceil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from term_frequency import compare_frequencies, median_frequencies  # noqa: E402
+
+
+def legacy_median_frequency(results):
+    word_frequencies_list = [Counter(result) for result in results]
+    df = pd.DataFrame(word_frequencies_list)
+    df = df.fillna(0)
+    median_frequencies = df.median()
+    median_frequencies = median_frequencies.sort_values(ascending=False)
+    return median_frequencies
+
+
+def legacy_compare_frequencies(main_lemmas, competitor_lemmas):
+    median_frequency = legacy_median_frequency(competitor_lemmas)
+    main_frequency = legacy_median_frequency([main_lemmas])
+    main_frequency.name = 'main_freq'
+    median_frequency.name = 'median_freq'
+    merged_df = pd.merge(main_frequency, median_frequency, left_index=True, right_index=True, how='outer')
+    merged_df.fillna(0, inplace=True)
+    merged_df['diff'] = merged_df['median_freq'] - merged_df['main_freq']
+    merged_df = merged_df.apply(ceil).astype(int)
+    lsi = merged_df[(merged_df['main_freq'] == 0) & (merged_df['median_freq'] > 0)]['median_freq']
+    lsi = lsi.sort_values(ascending=False)
+    increase_qty = merged_df[(merged_df['main_freq'] > 0) & (merged_df['diff'] > 0)]['diff']
+    increase_qty = increase_qty.sort_values(ascending=False)
+    decrease_qty = merged_df[(merged_df['main_freq'] > 0) & (merged_df['diff'] <= -10)]['diff']
+    decrease_qty = decrease_qty.sort_values(ascending=True)
+
+    if len(lsi) < 20:
+        need_to_add = 20 - len(lsi)
+        lsi = pd.concat([lsi, increase_qty[:need_to_add]])
+        lsi_dict = {index: 1 for index in lsi.index}
+        for index in increase_qty.index:
+            increase_qty[index] -= lsi_dict.get(index, 0)
+        increase_qty = increase_qty.mask(increase_qty <= 0).dropna()
+    return lsi, increase_qty, decrease_qty
+
+
+def make_documents(docs, vocabulary, doc_length, seed):
+    # Частоты слов в текстах близки к закону Ципфа
+    rng = random.Random(seed)
+    words = [f"слово{i}" for i in range(vocabulary)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary)]
+    return [rng.choices(words, weights=weights, k=rng.randint(doc_length // 10, doc_length)) for _ in range(docs)]
+
+
+def as_items(series):
+    return [(key, value, type(value).__name__) for key, value in series.items()]
+
+
+def check_parity(documents):
+    expected = legacy_compare_frequencies(documents[0], documents[1:])
+    actual = compare_frequencies(documents[0], documents[1:])
+    for name, left, right in zip(("lsi", "increase", "decrease"), expected, actual):
+        if as_items(left) != as_items(right):
+            raise AssertionError(f"Результаты расходятся: {name}")
+    if legacy_median_frequency(documents).to_dict() != median_frequencies(documents).to_dict():
+        raise AssertionError("Результаты расходятся: median_frequencies")
+
+
+def measure(func, documents, runs):
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(runs):
+        func(documents[0], documents[1:])
+    elapsed = (time.perf_counter() - started) / runs
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=30)
+    parser.add_argument("--vocabulary", type=int, default=40000)
+    parser.add_argument("--doc-length", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--parity-cases", type=int, default=50)
+    args = parser.parse_args()
+
+    # Проверка совпадения на небольших выдачах разного размера, включая пустые страницы
+    for seed in range(args.parity_cases):
+        rng = random.Random(seed)
+        documents = make_documents(rng.randint(1, 31), rng.randint(5, 500), rng.randint(0, 300), seed)
+        check_parity(documents)
+    check_parity([[]])
+    check_parity([["слово"], []])
+    print(f"Совпадение результатов: {args.parity_cases + 2} случаев")
+
+    documents = make_documents(args.docs + 1, args.vocabulary, args.doc_length, seed=0)
+    check_parity(documents)
+    legacy_time, legacy_peak = measure(legacy_compare_frequencies, documents, args.runs)
+    numpy_time, numpy_peak = measure(compare_frequencies, documents, args.runs)
+    print(f"pandas: {legacy_time * 1000:.1f} мс, пик памяти {legacy_peak / 2 ** 20:.1f} МБ")
+    print(f"numpy:  {numpy_time * 1000:.1f} мс, пик памяти {numpy_peak / 2 ** 20:.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
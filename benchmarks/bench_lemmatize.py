@@ -0,0 +1,84 @@
+"""Сравнение пакетной и подокументной лемматизации на выдачах из 30 страниц.
+
+Тексты берутся из таблицы page_content базы (по запросам) или из каталога с .txt файлами:
+
+    python benchmarks/bench_lemmatize.py --db database.sqlite --serps 10
+    python benchmarks/bench_lemmatize.py --corpus corpus/texts --serp-size 30
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mystem_pool import mystem_lemmatize, mystem_lemmatize_batch, _init_worker  # noqa: E402
+from page_store import decompress  # noqa: E402
+
+
+def load_serps_from_db(path, serps):
+    conn = sqlite3.connect(path)
+    request_ids = [row[0] for row in conn.execute(
+        "SELECT request_id FROM page_content GROUP BY request_id HAVING COUNT(*) >= 10 "
+        "ORDER BY request_id DESC LIMIT ?", (serps,)
+    )]
+    result = []
+    for request_id in request_ids:
+        rows = conn.execute(
+            "SELECT b.codec, b.data FROM page_content p JOIN page_blobs b ON b.hash = p.content_hash "
+            "WHERE p.request_id = ?", (request_id,)
+        )
+        result.append([decompress(data, codec) for codec, data in rows])
+    conn.close()
+    return result
+
+
+def load_serps_from_corpus(path, serp_size):
+    texts = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".txt"):
+            with open(os.path.join(path, name), encoding="utf-8") as f:
+                texts.append(f.read())
+    return [texts[i:i + serp_size] for i in range(0, len(texts), serp_size)]
+
+
+def run(serps, lemmatize):
+    started = time.perf_counter()
+    results = [lemmatize(serp) for serp in serps]
+    return time.perf_counter() - started, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="SQLite база с таблицей page_content")
+    parser.add_argument("--corpus", help="каталог с текстами страниц (*.txt)")
+    parser.add_argument("--serps", type=int, default=10, help="число выдач из базы")
+    parser.add_argument("--serp-size", type=int, default=30, help="число страниц в выдаче для --corpus")
+    args = parser.parse_args()
+
+    if args.db:
+        serps = load_serps_from_db(args.db, args.serps)
+    elif args.corpus:
+        serps = load_serps_from_corpus(args.corpus, args.serp_size)
+    else:
+        parser.error("нужно указать --db или --corpus")
+    if not serps:
+        parser.error("не найдено ни одной выдачи")
+
+    _init_worker()
+    pages = sum(len(serp) for serp in serps)
+    chars = sum(len(text) for serp in serps for text in serp)
+
+    per_doc_time, per_doc = run(serps, lambda serp: [mystem_lemmatize(text) for text in serp])
+    batch_time, batched = run(serps, mystem_lemmatize_batch)
+
+    print(f"Выдач: {len(serps)}, страниц: {pages}, символов: {chars}")
+    print(f"По документам: {per_doc_time:.2f} с, {pages / per_doc_time:.1f} стр/с")
+    print(f"Пакетно:       {batch_time:.2f} с, {pages / batch_time:.1f} стр/с")
+    print(f"Ускорение:     x{per_doc_time / batch_time:.2f}")
+    print(f"Результаты совпадают: {per_doc == batched}")
+
+
+if __name__ == "__main__":
+    main()
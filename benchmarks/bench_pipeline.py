@@ -0,0 +1,267 @@
+"""Бенчмарк полного анализа запроса без сети: выдача и страницы конкурентов отдаются сервером-заглушкой.
+
+Каждый сценарий запускается в отдельном процессе со своими базой, кэшем лемм и заглушкой,
+поэтому пиковая память и счётчики не смешиваются между сценариями:
+
+    python benchmarks/bench_pipeline.py --output results.json
+    python benchmarks/bench_pipeline.py --scenario concurrent --requests 100 --concurrency 16
+    python benchmarks/bench_pipeline.py --scenario large --page-kb 4096 --corpus corpus/html
+    python benchmarks/bench_pipeline.py --output new.json --baseline old.json
+
+Сценарии: single — запросы по одному, concurrent — параллельные запросы, large — большие страницы.
+У каждого запроса своя выдача и свои страницы, так что кэши выдачи, страниц и лемм не попадают.
+Результат — JSON с пропускной способностью, перцентилями задержки, временем этапов
+и пиковым RSS процесса и его дочерних процессов (воркеров Mystem).
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stub_server import add_arguments  # noqa: E402
+
+SCENARIOS = {
+    "single": {"requests": 5, "concurrency": 1, "page_kb": 50},
+    "concurrent": {"requests": 40, "concurrency": 8, "page_kb": 50},
+    "large": {"requests": 3, "concurrency": 1, "page_kb": 3072},
+}
+STAGES = ("request", "serp", "filter", "fetch", "page_fetch", "extract", "lemmatize", "frequency", "db_write")
+STUB_ARGUMENTS = ("seed", "serp_size", "delay_ms", "jitter_ms", "slow_fraction", "slow_ms", "corpus")
+
+
+def percentile(values: list, q: float) -> float:
+    # Ближайший ранг: значение, не меньше которого q процентов выборки
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Stub server did not start on port {port}")
+
+
+def start_stub(args, page_kb: int, port: int) -> subprocess.Popen:
+    command = [sys.executable, os.path.join(ROOT, "benchmarks", "stub_server.py"), "--port", str(port),
+               "--page-kb", str(page_kb)]
+    for name in STUB_ARGUMENTS:
+        value = getattr(args, name)
+        if value is not None:
+            command += [f"--{name.replace('_', '-')}", str(value)]
+    stub = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        stub.kill()
+        raise
+    return stub
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def stage_seconds() -> dict:
+    from prometheus_client import REGISTRY
+
+    result = {}
+    for name in STAGES:
+        count = REGISTRY.get_sample_value("autorelevant_stage_seconds_count", {"stage": name}) or 0
+        total = REGISTRY.get_sample_value("autorelevant_stage_seconds_sum", {"stage": name}) or 0.0
+        if count:
+            result[name] = {"count": int(count), "total_seconds": round(total, 4),
+                            "mean_ms": round(total / count * 1000, 2)}
+    return result
+
+
+async def run_requests(args, params: dict, base_url: str) -> dict:
+    # Модули приложения импортируются после настройки окружения: config читает его при импорте
+    from fastapi import BackgroundTasks
+
+    import main as app
+    from analysis import analyze_request, YANDEX, GOOGLE
+
+    provider = GOOGLE if args.provider == "google" else YANDEX
+    semaphore = asyncio.Semaphore(params["concurrency"])
+    latencies, errors = [], 0
+    background_tasks = BackgroundTasks()
+
+    async def run_one(index):
+        nonlocal errors
+        async with semaphore:
+            query = f"{args.scenario} запрос {args.seed} {index}"
+            started = time.perf_counter()
+            try:
+                db_request = await app.database.save_request(f"{base_url}/page/own-{index}/0", query,
+                                                             args.region, args.domain)
+                await analyze_request(app.database, background_tasks, db_request, provider)
+            except Exception as e:
+                errors += 1
+                print(f"Request {index} failed: {e}", file=sys.stderr)
+                return
+            latencies.append(time.perf_counter() - started)
+
+    await app.startup()
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*[run_one(index) for index in range(params["requests"])])
+        # Ответ API отдаётся до сохранения в базу, но пропускная способность учитывает и запись
+        await background_tasks()
+        wall = time.perf_counter() - started
+        stages = stage_seconds()
+    finally:
+        await app.shutdown()
+
+    result = {"requests": params["requests"], "errors": errors, "wall_seconds": round(wall, 3),
+              "throughput_rps": round(len(latencies) / wall, 3) if wall else 0.0}
+    if latencies:
+        latencies_ms = [latency * 1000 for latency in latencies]
+        result["latency_ms"] = {
+            "mean": round(sum(latencies_ms) / len(latencies_ms), 1),
+            "p50": round(percentile(latencies_ms, 50), 1),
+            "p90": round(percentile(latencies_ms, 90), 1),
+            "p95": round(percentile(latencies_ms, 95), 1),
+            "p99": round(percentile(latencies_ms, 99), 1),
+            "max": round(max(latencies_ms), 1),
+        }
+    result["stages"] = stages
+    return result
+
+
+def run_scenario(args) -> dict:
+    params = dict(SCENARIOS[args.scenario])
+    for name in ("requests", "concurrency", "page_kb"):
+        if getattr(args, name) is not None:
+            params[name] = getattr(args, name)
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    workdir = tempfile.mkdtemp(prefix="autorelevant-bench-")
+    os.environ.update({
+        "YANDEX_XML_URL": f"{base_url}/yandex/xml/",
+        "GOOGLE_SERP_URL": f"{base_url}/google/search",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'database.sqlite')}",
+        "LEMMA_CACHE_PATH": os.path.join(workdir, "lemma_cache.sqlite"),
+    })
+    # Заглушка не проверяет ключи, но без них параметры запроса к API не собрать
+    for name in ("XML_USER", "XML_KEY", "GOOGLE_API_KEY"):
+        os.environ.setdefault(name, "bench")
+    # Все страницы заглушки на одном хосте: лимит на хост не должен подменять собой реальную картину
+    os.environ.setdefault("HTTP_POOL_LIMIT_PER_HOST", os.environ.get("HTTP_POOL_LIMIT", "100"))
+    # Стоп-слова и список городов читаются по относительным путям
+    os.chdir(ROOT)
+
+    stub = start_stub(args, params["page_kb"], port)
+    try:
+        result = asyncio.run(run_requests(args, params, base_url))
+        # Воркеры Mystem уже завершены; заглушка ещё работает и в RUSAGE_CHILDREN не попадает
+        children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    finally:
+        stub.terminate()
+        stub.wait()
+    self_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss в Linux в килобайтах, в macOS — в байтах
+    scale = 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+    result.update({
+        "scenario": args.scenario,
+        "provider": args.provider,
+        "params": params,
+        "peak_rss_mb": round(self_peak / scale, 1),
+        "workers_peak_rss_mb": round(children_peak / scale, 1),
+    })
+    return result
+
+
+def compare(results: list, baseline: dict):
+    # Относительное изменение ключевых метрик к прошлому прогону; для задержки и памяти минус — улучшение
+    previous = {result["scenario"]: result for result in baseline.get("results", [])}
+    metrics = (("throughput_rps", lambda r: r.get("throughput_rps")),
+               ("p50_ms", lambda r: r.get("latency_ms", {}).get("p50")),
+               ("p95_ms", lambda r: r.get("latency_ms", {}).get("p95")),
+               ("peak_rss_mb", lambda r: r.get("peak_rss_mb")))
+    print(f"Сравнение с {baseline.get('commit') or 'базовым прогоном'}:", file=sys.stderr)
+    for result in results:
+        old = previous.get(result["scenario"])
+        if old is None:
+            continue
+        parts = []
+        for name, get in metrics:
+            before, after = get(old), get(result)
+            if before and after is not None:
+                parts.append(f"{name} {before} -> {after} ({(after - before) / before * 100:+.1f}%)")
+        print(f"  {result['scenario']}: {', '.join(parts)}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, help="число запросов в сценарии")
+    parser.add_argument("--concurrency", type=int, help="число одновременных запросов")
+    parser.add_argument("--provider", choices=("yandex", "google"), default="yandex")
+    parser.add_argument("--region", default="213")
+    parser.add_argument("--domain", default="google.ru")
+    parser.add_argument("--output", help="файл для результатов в JSON; по умолчанию stdout")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    add_arguments(parser)
+    # Размер страницы по умолчанию задаёт сценарий
+    parser.set_defaults(page_kb=None)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        args.scenario = args.run_scenario
+        print(json.dumps(run_scenario(args)))
+        return
+
+    results = []
+    for scenario in args.scenario:
+        # Последнее значение --scenario перекрывает переданный список
+        command = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + \
+                  ["--scenario", scenario, "--run-scenario", scenario]
+        completed = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+        if completed.returncode != 0:
+            parser.exit(completed.returncode, f"Scenario {scenario} failed\n")
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    report = {"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+              "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
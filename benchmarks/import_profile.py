@@ -0,0 +1,61 @@
+"""Время импорта модулей приложения по данным python -X importtime.
+
+Показывает самые долгие импорты по суммарному (с зависимостями) и собственному времени:
+
+    python benchmarks/import_profile.py
+    python benchmarks/import_profile.py --module utils --top 30 --json
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINE_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S.*)$")
+
+
+def profile(module: str) -> tuple:
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    modules = []
+    for line in completed.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            # Отступ — глубина вложенности импорта, по два пробела на уровень
+            modules.append({"module": name, "self_ms": int(self_us) / 1000,
+                            "cumulative_ms": int(cumulative_us) / 1000, "depth": len(indent) // 2})
+    total_ms = sum(item["cumulative_ms"] for item in modules if item["depth"] == 0)
+    return total_ms, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main", help="импортируемый модуль")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    total_ms, modules = profile(args.module)
+    by_cumulative = sorted(modules, key=lambda item: item["cumulative_ms"], reverse=True)[:args.top]
+    by_self = sorted(modules, key=lambda item: item["self_ms"], reverse=True)[:args.top]
+    if args.json:
+        print(json.dumps({"module": args.module, "total_ms": round(total_ms, 1), "modules": len(modules),
+                          "by_cumulative": by_cumulative, "by_self": by_self}, ensure_ascii=False, indent=2))
+        return
+
+    print(f"import {args.module}: {total_ms:.0f} мс, модулей: {len(modules)}")
+    print("\nПо суммарному времени:")
+    for item in by_cumulative:
+        print(f"  {item['cumulative_ms']:8.1f} мс  {item['module']}")
+    print("\nПо собственному времени:")
+    for item in by_self:
+        print(f"  {item['self_ms']:8.1f} мс  {item['module']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Локальный HTTP-сервер, заменяющий поисковые API и сайты конкурентов в бенчмарках.
+
+Отдаёт выдачу Яндекса (XML) и Google (JSON) со ссылками на свои же страницы и сами страницы.
+Страницы берутся из каталога с сохранёнными *.html или генерируются детерминированно по --seed:
+
+    python benchmarks/stub_server.py --port 8765 --page-kb 50 --delay-ms 30 --slow-fraction 0.05
+    python benchmarks/stub_server.py --port 8765 --corpus corpus/html
+
+Одинаковые параметры дают одинаковые выдачи, страницы и задержки, поэтому результаты
+бенчмарков сравнимы между коммитами.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+from xml.sax.saxutils import escape
+
+from aiohttp import web
+
+WORDS = (
+    "купить цена доставка магазин каталог товар скидка заказ оплата гарантия качество производитель "
+    "бетон кирпич плитка краска ламинат дверь окно кровля утеплитель фундамент ремонт строительство "
+    "квартира дом дача участок проект монтаж установка замер консультация специалист мастер бригада "
+    "недорого быстро надёжно выгодно официальный сертифицированный российский европейский новый "
+    "отзыв рейтинг сравнение характеристика размер цвет вес материал комплект упаковка склад наличие "
+    "москва петербург область район город регион клиент компания услуга работа опыт год срок день"
+).split()
+
+
+class StubCorpus:
+    """Детерминированный набор выдач и страниц для заданного seed."""
+
+    def __init__(self, seed: int, serp_size: int, page_kb: int, delay_ms: float, jitter_ms: float,
+                 slow_fraction: float, slow_ms: float, corpus_dir: str = None):
+        self.seed = seed
+        self.serp_size = serp_size
+        self.page_bytes = page_kb * 1024
+        self.delay_ms = delay_ms
+        self.jitter_ms = jitter_ms
+        self.slow_fraction = slow_fraction
+        self.slow_ms = slow_ms
+        self.recorded = self._load_recorded(corpus_dir) if corpus_dir else []
+
+    @staticmethod
+    def _load_recorded(path):
+        pages = []
+        for name in sorted(os.listdir(path)):
+            if name.endswith((".html", ".htm")):
+                with open(os.path.join(path, name), "rb") as f:
+                    pages.append(f.read())
+        return pages
+
+    def _random(self, *parts) -> random.Random:
+        key = ":".join(str(part) for part in (self.seed,) + parts)
+        return random.Random(hashlib.sha1(key.encode("utf-8")).digest())
+
+    def serp(self, query: str, base_url: str) -> list:
+        key = hashlib.sha1(query.encode("utf-8")).hexdigest()[:12]
+        return [f"{base_url}/page/{key}/{position}" for position in range(1, self.serp_size + 1)]
+
+    def delay(self, key: str, position: int) -> float:
+        rnd = self._random("delay", key, position)
+        delay_ms = self.delay_ms + rnd.random() * self.jitter_ms
+        if rnd.random() < self.slow_fraction:
+            delay_ms += self.slow_ms
+        return delay_ms / 1000
+
+    def page(self, key: str, position: int) -> bytes:
+        if self.recorded:
+            return self.recorded[int(hashlib.sha1(f"{key}:{position}".encode()).hexdigest(), 16) % len(self.recorded)]
+        rnd = self._random("page", key, position)
+        parts = [
+            "<!DOCTYPE html><html><head><meta charset=\"utf-8\">",
+            f"<title>{' '.join(rnd.choices(WORDS, k=6))}</title>",
+            "<style>body{font-family:sans-serif}.menu a{color:#333}</style>",
+            "<script>window.dataLayer=window.dataLayer||[];function gtag(){dataLayer.push(arguments)}</script>",
+            "</head><body><div class=\"menu\">",
+            "".join(f"<a href=\"/c/{i}\">{rnd.choice(WORDS)}</a>" for i in range(20)),
+            "</div><main>",
+        ]
+        size = sum(len(part.encode("utf-8")) for part in parts)
+        while size < self.page_bytes:
+            paragraph = f"<h2>{' '.join(rnd.choices(WORDS, k=4))}</h2><p>{' '.join(rnd.choices(WORDS, k=80))}.</p>"
+            parts.append(paragraph)
+            size += len(paragraph.encode("utf-8"))
+        parts.append("</main><footer>© компания</footer></body></html>")
+        return "".join(parts).encode("utf-8")
+
+
+def make_app(corpus: StubCorpus) -> web.Application:
+    async def yandex_xml(request):
+        urls = corpus.serp(request.query.get("query", ""), f"{request.scheme}://{request.host}")
+        docs = "".join(f"<group><doc><url>{escape(url)}</url></doc></group>" for url in urls)
+        body = f"<?xml version=\"1.0\" encoding=\"utf-8\"?><yandexsearch><response><results><grouping>" \
+               f"{docs}</grouping></results></response></yandexsearch>"
+        return web.Response(text=body, content_type="text/xml")
+
+    async def google_search(request):
+        urls = corpus.serp(request.query.get("q", ""), f"{request.scheme}://{request.host}")
+        return web.json_response({"organic_results": [{"link": url} for url in urls]})
+
+    async def page(request):
+        key = request.match_info["key"]
+        position = int(request.match_info["position"])
+        await asyncio.sleep(corpus.delay(key, position))
+        return web.Response(body=corpus.page(key, position), content_type="text/html", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/yandex/xml/", yandex_xml)
+    app.router.add_get("/google/search", google_search)
+    app.router.add_get("/page/{key}/{position}", page)
+    return app
+
+
+def add_arguments(parser):
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--serp-size", type=int, default=30, help="число ссылок в выдаче")
+    parser.add_argument("--page-kb", type=int, default=50, help="размер сгенерированной страницы, КБ")
+    parser.add_argument("--delay-ms", type=float, default=30, help="базовая задержка ответа страницы")
+    parser.add_argument("--jitter-ms", type=float, default=50, help="случайная добавка к задержке")
+    parser.add_argument("--slow-fraction", type=float, default=0.0, help="доля медленных страниц")
+    parser.add_argument("--slow-ms", type=float, default=3000, help="дополнительная задержка медленной страницы")
+    parser.add_argument("--corpus", help="каталог с сохранёнными страницами (*.html) вместо генерации")
+
+
+def corpus_from_args(args) -> StubCorpus:
+    return StubCorpus(args.seed, args.serp_size, args.page_kb, args.delay_ms, args.jitter_ms,
+                      args.slow_fraction, args.slow_ms, args.corpus)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(make_app(corpus_from_args(args)), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
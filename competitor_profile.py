@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import json
+import sys
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from config import (PAGE_CACHE_TTL, COMPETITOR_PROFILE_MAX_ENTRIES, COMPETITOR_PROFILE_MAX_BYTES,
+                    COMPETITOR_PROFILE_RETRY_TTL)
+from logger import logger
+from page_store import compress, decompress, DEFAULT_CODEC
+from term_frequency import sorted_medians
+
+# Версия формата сохранённого профиля
+PROFILE_VERSION = 4
+
+
+def make_profile_key(search_string: str, region: str, domain: str) -> str:
+    params = json.dumps([search_string, region, domain or ""], ensure_ascii=False)
+    return hashlib.sha1(params.encode("utf-8")).hexdigest()
+
+
+class CompetitorProfile:
+    """Частоты лемм страниц конкурентов по запросу и региону, не зависящие от анализируемой страницы.
+
+    terms — словарь лемм профиля, pages — URL -> (хэш текста, номера лемм в terms, частоты) для загруженных
+    страниц, failed — URL -> время неудачной загрузки для страниц выдачи, которые получить не удалось.
+    Частоты хранятся массивами int32, а не словарями: профили живут в памяти каждого процесса.
+    """
+
+    def __init__(self, key: str, terms: list, pages: dict, failed: dict, lemmas_version: str,
+                 updated_at: datetime):
+        self.key = key
+        self.terms = terms
+        self.pages = pages
+        self.failed = failed
+        self.lemmas_version = lemmas_version
+        self.updated_at = updated_at
+        # Медианы для последнего набора страниц: в выдаче по запросу он обычно один и тот же
+        self._medians = None
+        self.nbytes = self._estimate_size()
+
+    @classmethod
+    def from_counts(cls, key: str, page_counts: dict, failed: dict, lemmas_version: str, updated_at: datetime):
+        """Собирает профиль из page_counts: URL -> (хэш текста, словарь лемма -> частота)."""
+        vocabulary = {}
+        pages = {}
+        for url, (digest, counts) in page_counts.items():
+            ids = np.fromiter((vocabulary.setdefault(term, len(vocabulary)) for term in counts),
+                              dtype=np.int32, count=len(counts))
+            values = np.fromiter(counts.values(), dtype=np.int32, count=len(counts))
+            pages[url] = (digest, ids, values)
+        return cls(key, list(vocabulary), pages, failed, lemmas_version, updated_at)
+
+    def _estimate_size(self) -> int:
+        # Строки словаря и массивы частот; накладные расходы словарей Python учитываются грубо
+        size = sum(sys.getsizeof(term) for term in self.terms) + 8 * len(self.terms)
+        for url, (digest, ids, values) in self.pages.items():
+            size += sys.getsizeof(url) + sys.getsizeof(digest) + ids.nbytes + values.nbytes + 256
+        return size
+
+    def covers(self, urls, lemmas_version: str, ttl: timedelta, retry_ttl: timedelta) -> bool:
+        """Профиль подходит, если в нём есть все эти страницы, с той же лемматизацией и он не устарел.
+
+        Не загрузившаяся страница считается учтённой только retry_ttl: временный сбой не должен
+        исключать конкурента из медиан на весь срок жизни профиля.
+        """
+        now = datetime.now()
+        if self.lemmas_version != lemmas_version or now - self.updated_at >= ttl:
+            return False
+        return all(url in self.pages or (url in self.failed and now - self.failed[url] < retry_ttl)
+                   for url in urls)
+
+    def page_counts(self, url: str, digest: str):
+        """Частоты лемм страницы словарём лемма -> частота, если её текст не изменился."""
+        page = self.pages.get(url)
+        if page is None or page[0] != digest:
+            return None
+        return {self.terms[term_id]: count for term_id, count in zip(page[1].tolist(), page[2].tolist())}
+
+    def medians(self, urls):
+        """Леммы и медианы их частот по страницам профиля из urls; результат запоминается."""
+        selected = sorted(url for url in urls if url in self.pages)
+        if self._medians is not None and self._medians[0] == selected:
+            return self._medians[1]
+        matrix = np.zeros((len(selected), len(self.terms)), dtype=np.int32)
+        for row, url in enumerate(selected):
+            _, ids, values = self.pages[url]
+            matrix[row, ids] = values
+        # Леммы, которые встречаются только на невыбранных страницах, в медианы не попадают
+        present = matrix.any(axis=0)
+        result = sorted_medians(np.array(self.terms, dtype=object)[present], matrix[:, present])
+        self._medians = (selected, result)
+        return result
+
+    def to_row(self, search_string: str, region: str, domain: str) -> dict:
+        data = json.dumps({
+            "version": PROFILE_VERSION,
+            "lemmas": self.lemmas_version,
+            "failed": {url: failed_at.isoformat() for url, failed_at in self.failed.items()},
+            "terms": self.terms,
+            "pages": {url: [digest, ids.tolist(), values.tolist()]
+                      for url, (digest, ids, values) in self.pages.items()},
+        }, ensure_ascii=False)
+        return {'key': self.key, 'search_string': search_string, 'region': region, 'domain': domain or "",
+                'codec': DEFAULT_CODEC, 'data': compress(data), 'updated_at': self.updated_at}
+
+    @classmethod
+    def from_row(cls, row):
+        data = json.loads(decompress(row.data, row.codec))
+        if data.get("version") != PROFILE_VERSION:
+            return None
+        pages = {url: (digest, np.asarray(ids, dtype=np.int32), np.asarray(values, dtype=np.int32))
+                 for url, (digest, ids, values) in data["pages"].items()}
+        failed = {url: datetime.fromisoformat(failed_at) for url, failed_at in data["failed"].items()}
+        return cls(row.key, data["terms"], pages, failed, data["lemmas"], row.updated_at)
+
+
+class CompetitorProfileStore:
+    """Профили конкурентов в памяти процесса поверх таблицы competitor_profiles.
+
+    Размер ограничен и числом профилей, и их суммарным объёмом в байтах: профиль широкой выдачи
+    с длинными страницами занимает на порядки больше узкой.
+    """
+
+    def __init__(self, ttl: int, retry_ttl: int, max_entries: int, max_bytes: int):
+        self.ttl = timedelta(seconds=ttl)
+        self.retry_ttl = timedelta(seconds=retry_ttl)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.pages_reused = 0
+        self.pages_counted = 0
+
+    async def get(self, key: str, database):
+        profile = self._entries.get(key)
+        if profile is not None:
+            self._entries.move_to_end(key)
+            return profile
+        row = await database.get_competitor_profile(key)
+        if row is None:
+            return None
+        loop = asyncio.get_running_loop()
+        profile = await loop.run_in_executor(None, CompetitorProfile.from_row, row)
+        if profile is not None:
+            self.db_hits += 1
+            self.put(profile)
+        return profile
+
+    def put(self, profile: CompetitorProfile):
+        previous = self._entries.pop(profile.key, None)
+        if previous is not None:
+            self._bytes -= previous.nbytes
+        self._entries[profile.key] = profile
+        self._bytes += profile.nbytes
+        # Самый новый профиль остаётся, даже если один превышает лимит: он нужен текущему запросу
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def record(self, hit: bool, reused: int = 0, counted: int = 0):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.pages_reused += reused
+        self.pages_counted += counted
+        if not hit:
+            logger.info(f"Competitor profile rebuilt: {reused} pages reused, {counted} pages counted")
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self._bytes,
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "pages_reused": self.pages_reused,
+            "pages_counted": self.pages_counted,
+        }
+
+
+competitor_profiles = CompetitorProfileStore(PAGE_CACHE_TTL, COMPETITOR_PROFILE_RETRY_TTL,
+                                             COMPETITOR_PROFILE_MAX_ENTRIES, COMPETITOR_PROFILE_MAX_BYTES)
@@ -1,25 +1,124 @@
 import os
 from dotenv import load_dotenv
-# import nltk
-# nltk.download('stopwords')
-from nltk.corpus import stopwords
-
-def read_cities_from_file(filename):
-    try:
-        with open(filename, 'r', encoding='utf-8') as file:
-            cities = [city.strip().lower() for city in file.readlines()]
-            return cities
-    except FileNotFoundError:
-        print(f"Файл {filename} не найден.")
-        return []
-
 
 load_dotenv()
 
 xml_user = os.getenv("XML_USER")
 xml_key = os.getenv("XML_KEY")
 google_api_key = os.getenv("GOOGLE_API_KEY")
-DATABASE_URL = "sqlite+aiosqlite:///database.sqlite"
-russian_stop_words = set(stopwords.words('russian'))
-cities = read_cities_from_file("cities.txt")
-russian_stop_words.update(cities)
+# Адреса поисковых API; переопределяются, например, для бенчмарков с локальным сервером-заглушкой
+YANDEX_XML_URL = os.getenv("YANDEX_XML_URL", "https://xmlstock.com/yandex/xml/")
+GOOGLE_SERP_URL = os.getenv("GOOGLE_SERP_URL", "https://api.spaceserp.com/google/search")
+GOOGLE_XML_URL = os.getenv("GOOGLE_XML_URL", "https://xmlstock.com/google/json/")
+GOOGLE_GEOTARGETS_URL = os.getenv("GOOGLE_GEOTARGETS_URL", "https://xmlstock.com/geotargets-google.csv")
+# Поддерживаются SQLite (aiosqlite) и PostgreSQL (postgresql+asyncpg://..., требует пакет asyncpg)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///database.sqlite")
+
+# Стоп-слова для исключения сайтов из выдачи и названия городов, исключаемые из лемм вместе со стоп-словами NLTK
+# (корпус stopwords загружается через nltk.download('stopwords')); файлы перечитываются после изменения,
+# наличие изменений проверяется не чаще раза в FILTERS_RELOAD_INTERVAL секунд
+STOP_WORDS_PATH = os.getenv("STOP_WORDS_PATH", "stop_words.txt")
+CITIES_PATH = os.getenv("CITIES_PATH", "cities.txt")
+FILTERS_RELOAD_INTERVAL = float(os.getenv("FILTERS_RELOAD_INTERVAL", "5"))
+
+# Кэш лемм: путь к файлу и максимальное число хранимых документов
+LEMMA_CACHE_PATH = os.getenv("LEMMA_CACHE_PATH", "lemma_cache.sqlite")
+LEMMA_CACHE_MAX_ENTRIES = int(os.getenv("LEMMA_CACHE_MAX_ENTRIES", "50000"))
+
+# Число процессов приложения (воркеров uvicorn). При WORKERS > 1 общий кэш и очередь записи
+# на диске включаются по умолчанию; при запуске через gunicorn -w N нужно выставить WORKERS=N
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+# Пул процессов Mystem: число воркеров и максимальное число пачек в очереди;
+# по умолчанию ядра делятся поровну между процессами приложения
+MYSTEM_POOL_SIZE = int(os.getenv("MYSTEM_POOL_SIZE", str(max(1, (os.cpu_count() or 1) // WORKERS))))
+MYSTEM_POOL_MAX_PENDING = int(os.getenv("MYSTEM_POOL_MAX_PENDING", "256"))
+# Максимальный суммарный размер документов, склеиваемых в один вызов Mystem
+MYSTEM_BATCH_MAX_CHARS = int(os.getenv("MYSTEM_BATCH_MAX_CHARS", "5000000"))
+
+# Общий HTTP-клиент: лимиты соединений, кэш DNS и keep-alive
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "8"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+PAGE_FETCH_TIMEOUT = float(os.getenv("PAGE_FETCH_TIMEOUT", "10"))
+# Сколько случайных User-Agent выбирается из базы fake_useragent при запуске
+USER_AGENT_POOL_SIZE = int(os.getenv("USER_AGENT_POOL_SIZE", "50"))
+
+# Кэш загруженных страниц: сколько секунд страница считается свежей без перепроверки
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", "86400"))
+
+# Профили конкурентов (частоты лемм страниц выдачи по запросу): сколько профилей и байт хранить в памяти
+# процесса (лимит действует в каждом воркере); срок годности профиля тот же, что у кэша страниц
+COMPETITOR_PROFILE_MAX_ENTRIES = int(os.getenv("COMPETITOR_PROFILE_MAX_ENTRIES", "50"))
+COMPETITOR_PROFILE_MAX_BYTES = int(os.getenv("COMPETITOR_PROFILE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Через сколько секунд профиль перестаёт подходить, если страница конкурента при его построении не загрузилась
+COMPETITOR_PROFILE_RETRY_TTL = int(os.getenv("COMPETITOR_PROFILE_RETRY_TTL", "1800"))
+
+# Кэш поисковой выдачи: срок жизни в секундах и число запросов в памяти
+SERP_CACHE_TTL = int(os.getenv("SERP_CACHE_TTL", "21600"))
+SERP_CACHE_MAX_ENTRIES = int(os.getenv("SERP_CACHE_MAX_ENTRIES", "1000"))
+
+# Извлечение текста из HTML: число потоков и максимальный размер читаемой страницы в байтах
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "4"))
+PAGE_MAX_BYTES = int(os.getenv("PAGE_MAX_BYTES", str(5 * 1024 * 1024)))
+# Тела страниц с другим Content-Type не читаются; ответ без Content-Type считается HTML
+PAGE_CONTENT_TYPES = frozenset(os.getenv("PAGE_CONTENT_TYPES", "text/html,application/xhtml+xml").split(","))
+# Сколько байт тел страниц всего читается за один анализ; остальные страницы пропускаются
+REQUEST_MAX_PAGE_BYTES = int(os.getenv("REQUEST_MAX_PAGE_BYTES", str(64 * 1024 * 1024)))
+# Сколько слов документа отправляется в Mystem; хвост длинных страниц отбрасывается
+LEMMA_MAX_TOKENS = int(os.getenv("LEMMA_MAX_TOKENS", "100000"))
+
+# Отложенная запись: строки нескольких запросов копятся в памяти и сохраняются одной транзакцией
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "0") == "1"
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "2"))
+WRITE_BEHIND_MAX_ROWS = int(os.getenv("WRITE_BEHIND_MAX_ROWS", "5000"))
+# Сколько строк может ждать в памяти, пока база недоступна; сверх этого самые старые запросы отбрасываются
+WRITE_BEHIND_MAX_PENDING_ROWS = int(os.getenv("WRITE_BEHIND_MAX_PENDING_ROWS", str(WRITE_BEHIND_MAX_ROWS * 20)))
+# Наибольшая пауза между повторами записи после ошибок, в секундах
+WRITE_BEHIND_MAX_BACKOFF = float(os.getenv("WRITE_BEHIND_MAX_BACKOFF", "60"))
+
+# Кэш выдачи и страниц в файле SQLite, общий для всех воркеров на машине
+SHARED_CACHE_ENABLED = os.getenv("SHARED_CACHE_ENABLED", "1" if WORKERS > 1 else "0") == "1"
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "shared_cache.sqlite")
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "100000"))
+
+# Очередь записи на диске: воркеры складывают результаты запросов в каталог, в БД их пишет один процесс
+WRITE_SPOOL_ENABLED = os.getenv("WRITE_SPOOL_ENABLED", "1" if WORKERS > 1 else "0") == "1"
+WRITE_SPOOL_DIR = os.getenv("WRITE_SPOOL_DIR", "write_spool")
+WRITE_SPOOL_INTERVAL = float(os.getenv("WRITE_SPOOL_INTERVAL", "1"))
+
+# Пул соединений с базой и настройки SQLite, выставляемые при подключении
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", str(-64 * 1024)))
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "15000"))
+
+# Фоновые задания: число одновременно выполняемых, размер очереди и сколько секунд
+# готовый результат переиспользуется для повторной отправки с теми же параметрами
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))
+# Процессы приложения отмечаются в БД каждые JOB_HEARTBEAT_INTERVAL секунд; задания процесса,
+# не отмечавшегося дольше JOB_INSTANCE_TTL секунд, считаются брошенными и перезапускаются
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "10"))
+JOB_INSTANCE_TTL = float(os.getenv("JOB_INSTANCE_TTL", "60"))
+
+# Пакетный анализ: максимальное число элементов в запросе и число одновременно анализируемых
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# Планировщик загрузки страниц: срок на загрузку выдачи в секундах, число страниц конкурентов,
+# после которого анализ продолжается без ожидания остальных, и повторные запросы к медленным хостам
+FETCH_DEADLINE = float(os.getenv("FETCH_DEADLINE", "6"))
+FETCH_QUORUM = int(os.getenv("FETCH_QUORUM", "20"))
+FETCH_HEDGE_DELAY = float(os.getenv("FETCH_HEDGE_DELAY", "2"))
+FETCH_HEDGE_FACTOR = float(os.getenv("FETCH_HEDGE_FACTOR", "3"))
+FETCH_MAX_HEDGES = int(os.getenv("FETCH_MAX_HEDGES", "5"))
+FETCH_HOST_HISTORY = int(os.getenv("FETCH_HOST_HISTORY", "10000"))
+
+# Писать в лог время всех этапов каждого анализа запроса
+TRACE_REQUESTS = os.getenv("TRACE_REQUESTS", "0") == "1"
+# Замерять рост RSS процесса на каждом этапе; добавляет чтение /proc/self/statm на этап
+TRACE_MEMORY = os.getenv("TRACE_MEMORY", "0") == "1"
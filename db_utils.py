@@ -1,9 +1,18 @@
-from logger import logger
-from datetime import datetime
+import asyncio
+from datetime import datetime, date
+from urllib.parse import urlsplit
 
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Float, select, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy import (Column, Integer, String, ForeignKey, DateTime, Date, Float, Boolean, LargeBinary, Text, Table,
+                        MetaData, select, insert, func, inspect, event, bindparam)
+
+from config import DB_POOL_SIZE, DB_MAX_OVERFLOW, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE, SQLITE_BUSY_TIMEOUT
+from logger import logger
+from metrics import stage
+from page_store import pack_page_contents, hash_page_contents, pack_blobs, StoredPage, StoredCachedPage
 
 Base = declarative_base()
 
@@ -14,22 +23,45 @@ class UserRequest(Base):
     search_string = Column(String)
     region = Column(String)
     domain = Column(String)
-    requested_at = Column(DateTime(), default=datetime.now)
+    requested_at = Column(DateTime(), default=datetime.now, index=True)
+    # Нормализованные хост и путь URL для поиска по индексу
+    url_key = Column(String, index=True)
 
 
 class SearchResult(Base):
     __tablename__ = "search_results"
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    request_id = Column(Integer, ForeignKey("requests.id"), nullable=False)
+    request_id = Column(Integer, ForeignKey("requests.id"), nullable=False, index=True)
     url = Column(String, nullable=False)
     position = Column(Integer, nullable=False)
+    # Выдача взята из кэша, а не получена от поискового API для этого запроса
+    cached = Column(Boolean, nullable=False, default=False, server_default="0")
+
+class PageBlob(Base):
+    """Сжатый текст страницы, хранится один раз для всех запросов, где он встречался."""
+    __tablename__ = "page_blobs"
+    hash = Column(String, primary_key=True)
+    codec = Column(String, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    # Длина исходного текста в символах
+    size = Column(Integer, nullable=False)
+    created_at = Column(DateTime(), default=datetime.now)
 
 class PageContent(Base):
     __tablename__ = "page_content"
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    request_id = Column(Integer, ForeignKey("requests.id"), nullable=False)
+    request_id = Column(Integer, ForeignKey("requests.id"), nullable=False, index=True)
     url = Column(String, nullable=False)
-    content = Column(String, nullable=False)
+    content_hash = Column(String, ForeignKey("page_blobs.hash"), nullable=False, index=True)
+
+class CachedPage(Base):
+    """Последняя загруженная версия страницы по URL; текст хранится в page_blobs, как у page_content."""
+    __tablename__ = "page_cache"
+    url = Column(String, primary_key=True)
+    content_hash = Column(String, ForeignKey("page_blobs.hash"), nullable=False)
+    etag = Column(String)
+    last_modified = Column(String)
+    fetched_at = Column(DateTime(), default=datetime.now, nullable=False)
 
 class DecreaseFrequency(Base):
     __tablename__ = "decrease_frequency"
@@ -48,30 +80,326 @@ class IncreaseFrequency(Base):
 class LSI(Base):
     __tablename__ = "lsi"
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    request_id = Column(Integer, ForeignKey("requests.id"), nullable=False)
+    request_id = Column(Integer, ForeignKey("requests.id"), nullable=False, index=True)
     word = Column(String, nullable=False)
 
+class LSIDaily(Base):
+    """Число LSI-слов по нормализованному URL и дню, обновляется при каждом сохранении LSI."""
+    __tablename__ = "lsi_daily"
+    url_key = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    word = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class StoredCompetitorProfile(Base):
+    """Сжатый профиль частот лемм конкурентов по запросу, региону и домену поисковика."""
+    __tablename__ = "competitor_profiles"
+    key = Column(String, primary_key=True)
+    search_string = Column(String, nullable=False)
+    region = Column(String, nullable=False)
+    domain = Column(String, nullable=False, default="")
+    codec = Column(String, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime(), default=datetime.now, nullable=False)
+
+
+class SpooledBatch(Base):
+    """Файл очереди записи, строки которого уже сохранены: повторная запись файла пропускается."""
+    __tablename__ = "spool_batches"
+    name = Column(String, primary_key=True)
+    written_at = Column(DateTime(), default=datetime.now, nullable=False)
+
+
+class AppInstance(Base):
+    """Работающий экземпляр приложения и время его последней отметки."""
+    __tablename__ = "app_instances"
+    id = Column(String, primary_key=True)
+    heartbeat_at = Column(DateTime(), default=datetime.now, nullable=False)
+
+
+class Job(Base):
+    """Фоновое задание анализа, привязанное к сохранённому запросу."""
+    __tablename__ = "jobs"
+    id = Column(String, primary_key=True)
+    request_id = Column(Integer, ForeignKey("requests.id"), nullable=False, index=True)
+    provider = Column(String, nullable=False)
+    # Хэш параметров запроса для объединения повторных отправок
+    params_key = Column(String, nullable=False, index=True)
+    status = Column(String, nullable=False, index=True)
+    # Экземпляр приложения (процесс с момента запуска), который принял или выполняет задание
+    instance_id = Column(String)
+    result = Column(Text)
+    error = Column(String)
+    created_at = Column(DateTime(), default=datetime.now)
+    updated_at = Column(DateTime(), default=datetime.now, onupdate=datetime.now)
+
+
+def make_url_key(url: str) -> str:
+    """Приводит URL к виду хост/путь: без схемы, www, параметров и завершающего слэша."""
+    url = url.strip().lower()
+    if "://" not in url:
+        url = "//" + url
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    if host.startswith("www."):
+        host = host[4:]
+    return (host + parts.path).rstrip("/")
+
+
+def build_lsi_rollup(url_key: str, day: date, words: list) -> list:
+    return [{'url_key': url_key, 'day': day, 'word': word, 'count': 1} for word in words]
+
+
+def build_request_artifacts(db_request, search_results: dict, serp_cached: bool, contents: dict,
+                            cached_pages: list, decrease: dict, increase: dict, lsi: list,
+                            stored_pages: dict = None, profile: dict = None) -> dict:
+    """Собирает строки всех таблиц, которые сохраняются по итогам одного запроса.
+
+    stored_pages — URL -> хэш страниц, тексты которых уже есть в page_blobs (из профиля конкурентов),
+    profile — строка нового профиля конкурентов, если он пересчитан.
+    """
+    request_id = db_request.id
+    stored_pages = stored_pages or {}
+    return {
+        SearchResult.__tablename__: [
+            {'request_id': request_id, 'url': url, 'position': i, 'cached': serp_cached}
+            for i, url in search_results.items()
+        ],
+        PageContent.__tablename__: [
+            {'request_id': request_id, 'url': url, 'content': content}
+            for url, content in contents.items() if content is not None
+        ] + [
+            {'request_id': request_id, 'url': url, 'content_hash': digest} for url, digest in stored_pages.items()
+        ],
+        DecreaseFrequency.__tablename__: [
+            {'request_id': request_id, 'word': word, 'frequency_change': freq} for word, freq in decrease.items()
+        ],
+        IncreaseFrequency.__tablename__: [
+            {'request_id': request_id, 'word': word, 'frequency_change': freq} for word, freq in increase.items()
+        ],
+        LSI.__tablename__: [{'request_id': request_id, 'word': word} for word in lsi],
+        LSIDaily.__tablename__: build_lsi_rollup(db_request.url_key or make_url_key(db_request.url or ""),
+                                                 db_request.requested_at.date(), lsi),
+        CachedPage.__tablename__: cached_pages,
+        StoredCompetitorProfile.__tablename__: [profile] if profile else [],
+    }
+
+
+def merge_request_artifacts(batches: list) -> dict:
+    """Объединяет строки нескольких запросов для записи одной транзакцией."""
+    merged = {}
+    for artifacts in batches:
+        for table_name, rows in artifacts.items():
+            merged.setdefault(table_name, []).extend(rows)
+    return merged
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.close()
+
 
 class Database:
     def __init__(self, database_url):
-        self.engine = create_async_engine(database_url, echo=False, connect_args={"timeout": 15})
+        url = make_url(database_url)
+        self.is_sqlite = url.get_backend_name() == "sqlite"
+        engine_kwargs = {}
+        if self.is_sqlite:
+            engine_kwargs["connect_args"] = {"timeout": SQLITE_BUSY_TIMEOUT / 1000}
+        else:
+            engine_kwargs["pool_pre_ping"] = True
+        # База в памяти SQLite работает через одно общее соединение без пула
+        if not (self.is_sqlite and url.database in (None, "", ":memory:")):
+            engine_kwargs["pool_size"] = DB_POOL_SIZE
+            engine_kwargs["max_overflow"] = DB_MAX_OVERFLOW
+        self.engine = create_async_engine(database_url, echo=False, **engine_kwargs)
+        if self.is_sqlite:
+            event.listen(self.engine.sync_engine, "connect", _set_sqlite_pragmas)
         self.async_session = sessionmaker(self.engine, expire_on_commit=False, class_=AsyncSession)
         self.Base = Base
 
+    async def close(self):
+        await self.engine.dispose()
+        logger.info("Database connections closed")
+
+    def pool_stats(self) -> dict:
+        # У пулов без ограничения размера (одно соединение SQLite в памяти) этих счётчиков нет
+        pool = self.engine.pool
+        if not hasattr(pool, "checkedout"):
+            return {}
+        return {"size": pool.size(), "checked_out": pool.checkedout(), "overflow": max(0, pool.overflow())}
+
     async def create_all(self):
         async with self.engine.begin() as conn:
             try:
+                await conn.run_sync(self._rename_legacy_page_content)
+                await conn.run_sync(self._drop_legacy_page_cache)
                 await conn.run_sync(self.Base.metadata.create_all)
+                await conn.run_sync(self._migrate_legacy_page_content)
+                await conn.run_sync(self._add_missing_columns)
+                await conn.run_sync(self._create_missing_indexes)
+                await conn.run_sync(self._backfill_lsi_rollup)
                 logger.info("Tables created successfully")
             except Exception as e:
                 logger.error(f"Error creating tables: {e}")
                 raise e
 
+    def _add_missing_columns(self, conn):
+        # create_all не меняет существующие таблицы: добавляем новые столбцы в базы, созданные раньше
+        inspector = inspect(conn)
+        for table in self.Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=conn.dialect)
+                default = ""
+                if column.server_default is not None:
+                    default_value = column.server_default.arg
+                    default_value = f"'{default_value}'" if isinstance(default_value, str) else default_value.text
+                    default = f" DEFAULT {default_value}"
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}")
+                logger.info(f"Column {table.name}.{column.name} added")
+
+    def _rename_legacy_page_content(self, conn):
+        # Старая таблица page_content хранила текст целиком: переименовываем её для переноса в page_blobs
+        inspector = inspect(conn)
+        if "page_content" not in inspector.get_table_names():
+            return
+        if "content" not in {column["name"] for column in inspector.get_columns("page_content")}:
+            return
+        for index in inspector.get_indexes("page_content"):
+            conn.exec_driver_sql(f"DROP INDEX {index['name']}")
+        conn.exec_driver_sql("ALTER TABLE page_content RENAME TO page_content_legacy")
+        logger.info("Legacy page_content table renamed for migration")
+
+    def _drop_legacy_page_cache(self, conn):
+        # Прежний кэш страниц хранил текст без сжатия; это только кэш, страницы загрузятся заново
+        inspector = inspect(conn)
+        if "page_cache" not in inspector.get_table_names():
+            return
+        if "content" not in {column["name"] for column in inspector.get_columns("page_cache")}:
+            return
+        conn.exec_driver_sql("DROP TABLE page_cache")
+        logger.info("Legacy uncompressed page_cache table dropped")
+
+    def _migrate_legacy_page_content(self, conn, batch_size: int = 1000):
+        if "page_content_legacy" not in inspect(conn).get_table_names():
+            return
+        legacy = Table("page_content_legacy", MetaData(), autoload_with=conn)
+        last_id, migrated = 0, 0
+        while True:
+            rows = conn.execute(
+                select(legacy.c.id, legacy.c.request_id, legacy.c.url, legacy.c.content)
+                .where(legacy.c.id > last_id).order_by(legacy.c.id).limit(batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            page_rows, blobs = pack_page_contents(
+                [{'request_id': row[1], 'url': row[2], 'content': row[3]} for row in rows]
+            )
+            self._insert_blobs_sync(conn, blobs)
+            # Сохраняем прежние идентификаторы строк
+            for row, page_row in zip(rows, page_rows):
+                page_row['id'] = row[0]
+            conn.execute(insert(PageContent), page_rows)
+            last_id = rows[-1][0]
+            migrated += len(rows)
+        conn.exec_driver_sql("DROP TABLE page_content_legacy")
+        if not self.is_sqlite and migrated:
+            # Идентификаторы перенесены явно: сдвигаем последовательность за последний из них
+            conn.exec_driver_sql(
+                "SELECT setval(pg_get_serial_sequence('page_content', 'id'), (SELECT MAX(id) FROM page_content))"
+            )
+        logger.info(f"Page contents migrated to compressed storage: {migrated} rows")
+
+    def _blob_insert(self):
+        dialect_insert = sqlite.insert if self.is_sqlite else postgresql.insert
+        return dialect_insert(PageBlob).on_conflict_do_nothing(index_elements=[PageBlob.hash])
+
+    async def _upsert(self, session, model, rows: list, key: str):
+        """Вставляет строки пакетным INSERT, заменяя существующие строки с тем же ключом."""
+        # Из строк с одинаковым ключом берём последнюю: один оператор не может обновить строку дважды
+        rows = list({row[key]: row for row in rows}.values())
+        if not rows:
+            return
+        dialect_insert = sqlite.insert if self.is_sqlite else postgresql.insert
+        stmt = dialect_insert(model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[key],
+            set_={name: stmt.excluded[name] for name in rows[0] if name != key}
+        )
+        await session.execute(stmt, rows)
+
+    @staticmethod
+    async def _existing_blob_hashes(session, digests: list) -> set:
+        existing = set()
+        for i in range(0, len(digests), 500):
+            result = await session.execute(select(PageBlob.hash).where(PageBlob.hash.in_(digests[i:i + 500])))
+            existing.update(result.scalars().all())
+        return existing
+
+    def _insert_blobs_sync(self, conn, blobs: list):
+        if blobs:
+            conn.execute(self._blob_insert(), blobs)
+
+    def _create_missing_indexes(self, conn):
+        for table in self.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+    def _backfill_lsi_rollup(self, conn):
+        # Заполняем url_key у запросов, сохранённых до его появления
+        rows = conn.execute(select(UserRequest.id, UserRequest.url).where(UserRequest.url_key.is_(None))).fetchall()
+        if rows:
+            conn.execute(
+                UserRequest.__table__.update().where(UserRequest.id == bindparam("request_id")),
+                [{"request_id": row[0], "url_key": make_url_key(row[1] or "")} for row in rows]
+            )
+            logger.info(f"url_key filled for {len(rows)} requests")
+        # Накопительную таблицу строим по истории LSI один раз, пока она пуста
+        if conn.execute(select(LSIDaily.word).limit(1)).first() is not None:
+            return
+        if conn.execute(select(LSI.id).limit(1)).first() is None:
+            return
+        history = (
+            select(UserRequest.url_key, func.date(UserRequest.requested_at), LSI.word, func.count(LSI.id))
+            .join(UserRequest, LSI.request_id == UserRequest.id)
+            .group_by(UserRequest.url_key, func.date(UserRequest.requested_at), LSI.word)
+        )
+        conn.execute(insert(LSIDaily).from_select(["url_key", "day", "word", "count"], history))
+        logger.info("LSI daily rollup built from history")
+
+    async def _upsert_lsi_rollup(self, session, rows: list):
+        # Складываем строки с одинаковым ключом, затем увеличиваем счётчики в базе
+        counts = {}
+        for row in rows:
+            key = (row['url_key'], row['day'], row['word'])
+            counts[key] = counts.get(key, 0) + row['count']
+        if not counts:
+            return
+        values = [{'url_key': url_key, 'day': day, 'word': word, 'count': count}
+                  for (url_key, day, word), count in counts.items()]
+        dialect_insert = sqlite.insert if self.is_sqlite else postgresql.insert
+        stmt = dialect_insert(LSIDaily)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[LSIDaily.url_key, LSIDaily.day, LSIDaily.word],
+            set_={'count': LSIDaily.count + stmt.excluded.count}
+        )
+        await session.execute(stmt, values)
+
     async def save_request(self, url: str, search_string: str, region: str, domain: str):
         async with self.async_session() as session:
             try:
                 async with session.begin():
-                    db_request = UserRequest(url=url, search_string=search_string, region=region, domain=domain)
+                    db_request = UserRequest(url=url, search_string=search_string, region=region, domain=domain,
+                                             url_key=make_url_key(url))
                     session.add(db_request)
                 await session.commit()
                 logger.info(f"Request saved: {url}, {search_string}, {region}, {domain}")
@@ -80,90 +408,270 @@ class Database:
                 logger.error(f"Error saving request {url}, {search_string}, {region}, {domain}: {e}")
                 raise e
 
-    async def save_search_results(self, request_id: int, urls: dict):
+    async def get_recent_search_results(self, search_string: str, region: str, domain: str, date_from: datetime):
+        async with self.async_session() as session:
+            try:
+                # Последняя выдача, полученная от поискового API для тех же параметров
+                stmt = (
+                    select(UserRequest.id)
+                    .join(SearchResult, SearchResult.request_id == UserRequest.id)
+                    .where(UserRequest.search_string == search_string)
+                    .where(UserRequest.region == region)
+                    .where(UserRequest.domain == domain)
+                    .where(UserRequest.requested_at >= date_from)
+                    .where(SearchResult.cached.is_(False))
+                    .order_by(UserRequest.requested_at.desc())
+                    .limit(1)
+                )
+                request_id = (await session.execute(stmt)).scalar()
+                if request_id is None:
+                    return None
+                stmt = (
+                    select(SearchResult.position, SearchResult.url)
+                    .where(SearchResult.request_id == request_id)
+                    .order_by(SearchResult.position)
+                )
+                result = await session.execute(stmt)
+                search_results = {row[0]: row[1] for row in result.fetchall()}
+                logger.info(f"Search results loaded from request {request_id}: {len(search_results)} items")
+                return search_results
+            except Exception as e:
+                logger.error(f"Error loading search results for {search_string}, {region}, {domain}: {e}")
+                raise e
+
+    async def save_artifacts(self, artifacts: dict):
+        """Сохраняет строки нескольких таблиц одной транзакцией пакетными INSERT."""
+        with stage("db_write"):
+            await self._save_artifacts(artifacts)
+
+    async def _save_artifacts(self, artifacts: dict):
+        async with self.async_session() as session:
+            try:
+                async with session.begin():
+                    # Тексты страниц и кэша загрузок хэшируются вне цикла событий и хранятся один раз на хэш
+                    loop = asyncio.get_running_loop()
+                    page_rows, texts = await loop.run_in_executor(
+                        None, hash_page_contents, artifacts.get(PageContent.__tablename__, [])
+                    )
+                    cache_rows, cache_texts = await loop.run_in_executor(
+                        None, hash_page_contents, artifacts.get(CachedPage.__tablename__, [])
+                    )
+                    texts.update(cache_texts)
+                    # Сжимаем только тексты, которых ещё нет в page_blobs
+                    existing = await self._existing_blob_hashes(session, list(texts))
+                    new_texts = {digest: text for digest, text in texts.items() if digest not in existing}
+                    if new_texts:
+                        blobs = await loop.run_in_executor(None, pack_blobs, new_texts)
+                        await session.execute(self._blob_insert(), blobs)
+                    if page_rows:
+                        await session.execute(insert(PageContent), page_rows)
+                    for table_name, rows in artifacts.items():
+                        if not rows or table_name in (PageContent.__tablename__, CachedPage.__tablename__,
+                                                      LSIDaily.__tablename__,
+                                                      StoredCompetitorProfile.__tablename__):
+                            continue
+                        await session.execute(insert(self.Base.metadata.tables[table_name]), rows)
+                    await self._upsert_lsi_rollup(session, artifacts.get(LSIDaily.__tablename__, []))
+                    # Кэш страниц обновляется по URL, а профиль конкурентов по запросу один: новые строки
+                    # заменяют прежние
+                    await self._upsert(session, CachedPage, cache_rows, "url")
+                    await self._upsert(session, StoredCompetitorProfile,
+                                       artifacts.get(StoredCompetitorProfile.__tablename__, []), "key")
+                await session.commit()
+                counts = ", ".join(f"{table_name}: {len(rows)}" for table_name, rows in artifacts.items() if rows)
+                logger.info(f"Request artifacts saved: {counts}")
+            except Exception as e:
+                logger.error(f"Error saving request artifacts: {e}")
+                raise e
+
+    async def get_cached_pages(self, urls: list):
+        """Страницы кэша загрузок по URL; текст распаковывается при обращении к content."""
+        async with self.async_session() as session:
+            try:
+                stmt = (
+                    select(CachedPage.url, PageBlob.hash, PageBlob.codec, PageBlob.data, CachedPage.etag,
+                           CachedPage.last_modified, CachedPage.fetched_at)
+                    .join(PageBlob, CachedPage.content_hash == PageBlob.hash)
+                    .where(CachedPage.url.in_(urls))
+                )
+                result = await session.execute(stmt)
+                pages = {row[0]: StoredCachedPage(*row) for row in result.fetchall()}
+                logger.info(f"Cached pages loaded: {len(pages)} of {len(urls)}")
+                return pages
+            except Exception as e:
+                logger.error(f"Error loading cached pages: {e}")
+                raise e
+
+    async def get_spooled_batches(self, names: list) -> set:
+        """Имена файлов очереди записи из names, строки которых уже сохранены."""
+        async with self.async_session() as session:
+            try:
+                result = await session.execute(select(SpooledBatch.name).where(SpooledBatch.name.in_(names)))
+                return set(result.scalars().all())
+            except Exception as e:
+                logger.error(f"Error loading spooled batches: {e}")
+                raise e
+
+    async def get_competitor_profile(self, key: str):
+        async with self.async_session() as session:
+            try:
+                return await session.get(StoredCompetitorProfile, key)
+            except Exception as e:
+                logger.error(f"Error loading competitor profile {key}: {e}")
+                raise e
+
+    async def create_job(self, job_id: str, request_id: int, provider: str, params_key: str, status: str,
+                         instance_id: str = None):
         async with self.async_session() as session:
             try:
                 async with session.begin():
-                    results = [SearchResult(request_id=request_id, url=url, position=i) for i, url in urls.items()]
-                    session.add_all(results)
+                    job = Job(id=job_id, request_id=request_id, provider=provider, params_key=params_key,
+                              status=status, instance_id=instance_id)
+                    session.add(job)
                 await session.commit()
-                logger.info(f"Search results saved: {len(results)} items")
+                logger.info(f"Job created: {job_id} for request {request_id}")
+                return job
             except Exception as e:
-                logger.error(f"Error saving search results: {e}")
+                logger.error(f"Error creating job for request {request_id}: {e}")
                 raise e
 
-    async def save_page_contents(self, request_id: int, contents: dict):
+    async def get_job(self, job_id: str):
+        async with self.async_session() as session:
+            try:
+                return await session.get(Job, job_id)
+            except Exception as e:
+                logger.error(f"Error loading job {job_id}: {e}")
+                raise e
+
+    async def find_job(self, params_key: str, statuses: list, date_from: datetime):
+        """Последнее задание с теми же параметрами в одном из статусов, обновлённое не раньше date_from."""
+        async with self.async_session() as session:
+            try:
+                stmt = (
+                    select(Job)
+                    .where(Job.params_key == params_key)
+                    .where(Job.status.in_(statuses))
+                    .where(Job.updated_at >= date_from)
+                    .order_by(Job.created_at.desc())
+                    .limit(1)
+                )
+                return (await session.execute(stmt)).scalar()
+            except Exception as e:
+                logger.error(f"Error searching job {params_key}: {e}")
+                raise e
+
+    async def get_jobs_by_status(self, statuses: list):
+        async with self.async_session() as session:
+            try:
+                stmt = select(Job).where(Job.status.in_(statuses)).order_by(Job.created_at)
+                return list((await session.execute(stmt)).scalars().all())
+            except Exception as e:
+                logger.error(f"Error loading jobs: {e}")
+                raise e
+
+    async def update_job(self, job_id: str, status: str, result: str = None, error: str = None,
+                         instance_id: str = None):
         async with self.async_session() as session:
             try:
                 async with session.begin():
-                    page_contents = [
-                        PageContent(request_id=request_id, url=url, content=content)
-                        for url, content in contents.items() if content is not None
-                    ]
-                    session.add_all(page_contents)
+                    job = await session.get(Job, job_id)
+                    job.status = status
+                    job.result = result
+                    job.error = error
+                    if instance_id is not None:
+                        job.instance_id = instance_id
                 await session.commit()
-                logger.info(f"Page contents saved: {len(page_contents)} items")
+                logger.info(f"Job {job_id} is {status}")
             except Exception as e:
-                logger.error(f"Error saving page contents: {e}")
+                logger.error(f"Error updating job {job_id}: {e}")
                 raise e
 
-    async def save_decrease_frequency(self, request_id: int, changes: dict):
+    async def claim_job(self, job_id: str, previous_instance_id, instance_id: str) -> bool:
+        """Передаёт задание экземпляру instance_id, если его ещё не забрал другой; True при успехе."""
         async with self.async_session() as session:
             try:
                 async with session.begin():
-                    decrease_changes = [
-                        DecreaseFrequency(request_id=request_id, word=word, frequency_change=freq)
-                        for word, freq in changes.items()
-                    ]
-                    session.add_all(decrease_changes)
+                    owner = (Job.instance_id.is_(None) if previous_instance_id is None
+                             else Job.instance_id == previous_instance_id)
+                    result = await session.execute(
+                        Job.__table__.update().where(Job.id == job_id).where(owner).values(instance_id=instance_id)
+                    )
                 await session.commit()
-                logger.info(f"Decrease frequency changes saved: {len(decrease_changes)} items")
+                return result.rowcount == 1
             except Exception as e:
-                logger.error(f"Error saving decrease frequency changes: {e}")
+                logger.error(f"Error claiming job {job_id}: {e}")
                 raise e
 
-    async def save_increase_frequency(self, request_id: int, changes: dict):
+    async def heartbeat(self, instance_id: str):
         async with self.async_session() as session:
             try:
                 async with session.begin():
-                    increase_changes = [
-                        IncreaseFrequency(request_id=request_id, word=word, frequency_change=freq)
-                        for word, freq in changes.items()
-                    ]
-                    session.add_all(increase_changes)
+                    await self._upsert(session, AppInstance, [{'id': instance_id, 'heartbeat_at': datetime.now()}], "id")
                 await session.commit()
-                logger.info(f"Increase frequency changes saved: {len(increase_changes)} items")
             except Exception as e:
-                logger.error(f"Error saving increase frequency changes: {e}")
+                logger.error(f"Error saving heartbeat of {instance_id}: {e}")
                 raise e
 
-    async def save_lsi(self, request_id: int, words: list):
+    async def remove_instance(self, instance_id: str):
         async with self.async_session() as session:
             try:
                 async with session.begin():
-                    lsi_changes = [
-                        LSI(request_id=request_id, word=word)
-                        for word in words
-                    ]
-                    session.add_all(lsi_changes)
+                    await session.execute(AppInstance.__table__.delete().where(AppInstance.id == instance_id))
                 await session.commit()
-                logger.info(f"LSI words saved: {len(lsi_changes)} items")
             except Exception as e:
-                logger.error(f"Error saving LSI words: {e}")
+                logger.error(f"Error removing instance {instance_id}: {e}")
+                raise e
+
+    async def get_live_instances(self, date_from: datetime) -> set:
+        """Экземпляры приложения, отмечавшиеся не раньше date_from."""
+        async with self.async_session() as session:
+            try:
+                result = await session.execute(select(AppInstance.id).where(AppInstance.heartbeat_at >= date_from))
+                return set(result.scalars().all())
+            except Exception as e:
+                logger.error(f"Error loading live instances: {e}")
+                raise e
+
+    async def get_request(self, request_id: int):
+        async with self.async_session() as session:
+            try:
+                return await session.get(UserRequest, request_id)
+            except Exception as e:
+                logger.error(f"Error loading request {request_id}: {e}")
+                raise e
+
+    async def get_page_contents(self, request_id: int) -> list:
+        """Возвращает страницы запроса; текст каждой распаковывается при обращении к content."""
+        async with self.async_session() as session:
+            try:
+                stmt = (
+                    select(PageContent.url, PageBlob.hash, PageBlob.codec, PageBlob.data)
+                    .join(PageBlob, PageContent.content_hash == PageBlob.hash)
+                    .where(PageContent.request_id == request_id)
+                    .order_by(PageContent.id)
+                )
+                result = await session.execute(stmt)
+                pages = [StoredPage(*row) for row in result.fetchall()]
+                logger.info(f"Page contents loaded for request {request_id}: {len(pages)} items")
+                return pages
+            except Exception as e:
+                logger.error(f"Error loading page contents for request {request_id}: {e}")
                 raise e
 
     async def get_lsi_words(self, url_pattern: str, date_from: datetime):
         async with self.async_session() as session:
             try:
                 async with session.begin():
-                    # Объединяем запросы в один, используя подзапрос и join
+                    # Суммируем дневные счётчики по всем URL, начинающимся с нормализованного шаблона
+                    url_key = make_url_key(url_pattern)
+                    total = func.sum(LSIDaily.count)
                     stmt = (
-                        select(LSI.word, func.count(LSI.word).label('count'))
-                        .join(UserRequest, LSI.request_id == UserRequest.id)
-                        .where(UserRequest.url.like(f"%{url_pattern}%"))
-                        .where(UserRequest.requested_at >= date_from)
-                        .group_by(LSI.word)
-                        .order_by(func.count(LSI.word).desc())
+                        select(LSIDaily.word, total.label('count'))
+                        .where(LSIDaily.url_key >= url_key)
+                        .where(LSIDaily.url_key < url_key + "\uffff")
+                        .where(LSIDaily.day >= date_from.date())
+                        .group_by(LSIDaily.word)
+                        .order_by(total.desc())
                     )
                     result = await session.execute(stmt)
                     lsi_words = {row[0]: row[1] for row in result.fetchall()}
@@ -0,0 +1,184 @@
+import asyncio
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from config import (FETCH_DEADLINE, FETCH_QUORUM, FETCH_HEDGE_DELAY, FETCH_HEDGE_FACTOR, FETCH_MAX_HEDGES,
+                    FETCH_HOST_HISTORY, PAGE_FETCH_TIMEOUT)
+from logger import logger
+
+
+class HostLatency:
+    """История задержек по хостам: экспоненциальное среднее времени загрузки страницы."""
+
+    def __init__(self, max_hosts: int, alpha: float = 0.3, failure_penalty: float = PAGE_FETCH_TIMEOUT,
+                 default: float = 1.0):
+        self.max_hosts = max_hosts
+        self.alpha = alpha
+        self.failure_penalty = failure_penalty
+        self.default = default
+        self._hosts = OrderedDict()
+
+    @staticmethod
+    def host(url: str) -> str:
+        return urlsplit(url).hostname or url
+
+    def expected(self, url: str):
+        """Ожидаемое время загрузки или None, если хост ещё не встречался."""
+        return self._hosts.get(self.host(url))
+
+    def observe(self, url: str, seconds: float, success: bool = True):
+        # Неудачная загрузка считается не быстрее штрафного времени, чтобы такой хост уходил в конец очереди
+        if not success:
+            seconds = max(seconds, self.failure_penalty)
+        host = self.host(url)
+        previous = self._hosts.pop(host, None)
+        self._hosts[host] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+        while len(self._hosts) > self.max_hosts:
+            self._hosts.popitem(last=False)
+
+    def order(self, urls: dict) -> list:
+        """Пары (номер, URL): сначала анализируемая страница, затем хосты от быстрых к медленным."""
+        def key(item):
+            expected = self.expected(item[1])
+            return item[0] != 0, self.default if expected is None else expected
+
+        return sorted(urls.items(), key=key)
+
+
+class FetchScheduler:
+    """Загрузка страниц выдачи со сроком на запрос, кворумом конкурентов и дублирующими запросами.
+
+    Анализ продолжается, как только загружены анализируемая страница и quorum страниц конкурентов
+    или истёк deadline; оставшиеся загрузки отменяются. Если загрузка идёт дольше обычного для хоста,
+    запускается ещё одна попытка, и используется тот ответ, что придёт первым.
+    """
+
+    def __init__(self, latency: HostLatency, deadline: float, quorum: int, hedge_delay: float,
+                 hedge_factor: float, max_hedges: int):
+        self.latency = latency
+        self.deadline = deadline
+        self.quorum = quorum
+        self.hedge_delay = hedge_delay
+        self.hedge_factor = hedge_factor
+        self.max_hedges = max_hedges
+        self.early_completions = 0
+        self.deadline_hits = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.cancelled = 0
+
+    def _hedge_after(self, url: str) -> float:
+        expected = self.latency.expected(url)
+        if expected is None:
+            return self.hedge_delay
+        return max(self.hedge_delay, expected * self.hedge_factor)
+
+    async def run(self, urls: dict, fetch, available: int = 0) -> dict:
+        """Загружает страницы и возвращает словарь URL -> текст (None, если страница не получена).
+
+        fetch(num_of_url, url, attempt) возвращает awaitable с парой (url, content).
+        available — число страниц конкурентов, уже взятых из кэша; они засчитываются в кворум.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        competitors = sum(1 for num_of_url in urls if num_of_url != 0)
+        quorum = max(0, min(self.quorum, competitors + available) - available)
+        pending = {}
+        hedged = set()
+        results = {}
+        fetched = 0
+        main_url = urls.get(0)
+        main_done = main_url is None
+
+        def launch(num_of_url, url, attempt):
+            task = asyncio.ensure_future(fetch(num_of_url, url, attempt))
+            pending[task] = (num_of_url, url, attempt, loop.time())
+
+        for num_of_url, url in self.latency.order(urls):
+            launch(num_of_url, url, 0)
+
+        try:
+            while pending:
+                now = loop.time()
+                if main_done and fetched >= quorum:
+                    self.early_completions += 1
+                    break
+                if main_done and now >= deadline:
+                    self.deadline_hits += 1
+                    break
+                # Просыпаемся при завершении загрузки, по сроку запроса или ко времени дублирующего запроса
+                wake_at = [deadline] if now < deadline else []
+                if now < deadline and len(hedged) < self.max_hedges:
+                    wake_at += [started + self._hedge_after(url) for num_of_url, url, attempt, started
+                                in pending.values() if attempt == 0 and url not in hedged]
+                timeout = max(0.0, min(wake_at) - now) if wake_at else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                now = loop.time()
+
+                for task in done:
+                    # Задачу могли уже снять вместе с другой попыткой того же URL
+                    entry = pending.pop(task, None)
+                    if entry is None:
+                        continue
+                    num_of_url, url, attempt, started = entry
+                    try:
+                        _, content = task.result()
+                    except Exception as e:
+                        logger.error(f"Error fetching URL {url}: {e}")
+                        content = None
+                    self.latency.observe(url, now - started, bool(content))
+                    if results.get(url):
+                        continue
+                    if content:
+                        results[url] = content
+                        if attempt > 0:
+                            self.hedge_wins += 1
+                        # Вторая попытка для этого URL больше не нужна
+                        for other, (_, other_url, _, _) in list(pending.items()):
+                            if other_url == url:
+                                other.cancel()
+                                del pending[other]
+                    elif not any(other_url == url for _, other_url, _, _ in pending.values()):
+                        results[url] = None
+                    else:
+                        continue
+                    if url == main_url:
+                        main_done = True
+                    elif content:
+                        fetched += 1
+
+                if now < deadline:
+                    for num_of_url, url, attempt, started in list(pending.values()):
+                        if len(hedged) >= self.max_hedges:
+                            break
+                        if attempt == 0 and url not in hedged and now - started >= self._hedge_after(url):
+                            hedged.add(url)
+                            self.hedges += 1
+                            logger.info(f"Страница {url} загружается медленно, запускаем повторный запрос")
+                            launch(num_of_url, url, 1)
+        finally:
+            # Отставшие загрузки отменяем; их время — нижняя оценка задержки хоста
+            now = loop.time()
+            for task, (num_of_url, url, attempt, started) in pending.items():
+                task.cancel()
+                self.latency.observe(url, now - started)
+            self.cancelled += len(pending)
+            if pending:
+                logger.info(f"Fetch scheduler: {len(pending)} slow fetches cancelled, {fetched} competitor pages loaded")
+                await asyncio.gather(*pending, return_exceptions=True)
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "early_completions": self.early_completions,
+            "deadline_hits": self.deadline_hits,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "cancelled": self.cancelled,
+            "hosts": len(self.latency._hosts),
+        }
+
+
+host_latency = HostLatency(FETCH_HOST_HISTORY)
+fetch_scheduler = FetchScheduler(host_latency, FETCH_DEADLINE, FETCH_QUORUM, FETCH_HEDGE_DELAY,
+                                 FETCH_HEDGE_FACTOR, FETCH_MAX_HEDGES)
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import re
+import time
+from urllib.parse import urlsplit
+
+from config import STOP_WORDS_PATH, CITIES_PATH, FILTERS_RELOAD_INTERVAL
+from logger import logger
+
+
+def read_words(path: str) -> list:
+    """Читает непустые строки файла в нижнем регистре; отсутствующий файл — пустой список."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return [word for word in (line.strip().lower() for line in f) if word]
+    except FileNotFoundError:
+        logger.warning(f"Файл {path} не найден")
+        return []
+
+
+class WatchedFile:
+    """Следит за временем изменения файла, проверяя его не чаще раза в interval секунд."""
+
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        self._mtime = None
+        self._checked_at = 0.0
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def mark_loaded(self):
+        self._mtime = self._stat()
+        self._checked_at = time.monotonic()
+
+    def changed(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at < self.interval:
+            return False
+        self._checked_at = now
+        return self._stat() != self._mtime
+
+
+class UrlFilter:
+    """Исключает из выдачи сайты, в имени хоста которых встречается стоп-слово из файла.
+
+    Стоп-слова собраны в одно регулярное выражение: хост проверяется одним проходом
+    вместо поиска каждого стоп-слова по всему URL. Файл перечитывается при изменении.
+    """
+
+    def __init__(self, path: str, reload_interval: float):
+        self._file = WatchedFile(path, reload_interval)
+        self._pattern = None
+        self._size = 0
+        self.loaded = False
+        self.reloads = 0
+        self.checked = 0
+        self.excluded = 0
+
+    def load(self):
+        words = sorted(set(read_words(self._file.path)), key=len, reverse=True)
+        pattern = re.compile("|".join(map(re.escape, words))) if words else None
+        self._pattern = pattern
+        self._size = len(words)
+        self._file.mark_loaded()
+        if self.loaded:
+            self.reloads += 1
+        self.loaded = True
+        logger.info(f"URL filter loaded: {len(words)} stop words from {self._file.path}")
+
+    def _current_pattern(self):
+        if not self.loaded or self._file.changed():
+            self.load()
+        return self._pattern
+
+    @staticmethod
+    def host(url: str) -> str:
+        try:
+            return urlsplit(url).hostname or ""
+        except ValueError:
+            return url.lower()
+
+    def is_excluded(self, url: str, pattern=None) -> bool:
+        if not url:
+            return True
+        pattern = pattern or self._current_pattern()
+        return pattern is not None and pattern.search(self.host(url)) is not None
+
+    def filter(self, urls: list) -> list:
+        """Возвращает URL-адреса, хосты которых не содержат стоп-слов, в исходном порядке."""
+        pattern = self._current_pattern()
+        filtered = [url for url in urls if not self.is_excluded(url, pattern)]
+        self.checked += len(urls)
+        self.excluded += len(urls) - len(filtered)
+        return filtered
+
+    def stats(self) -> dict:
+        return {"entries": self._size, "reloads": self.reloads, "checked": self.checked, "excluded": self.excluded}
+
+
+class LemmaStopWords:
+    """Стоп-слова для лемм: русские стоп-слова NLTK и названия городов, перечитываемые при изменении файла."""
+
+    def __init__(self, cities_path: str, reload_interval: float):
+        self._file = WatchedFile(cities_path, reload_interval)
+        self._base = None
+        self._words = frozenset()
+        self._version = ""
+        self.loaded = False
+        self.reloads = 0
+
+    def load(self):
+        if self._base is None:
+            from nltk.corpus import stopwords
+
+            self._base = frozenset(stopwords.words('russian'))
+        words = self._base | frozenset(read_words(self._file.path))
+        self._words = words
+        # Версия набора: сохранённые частоты лемм, посчитанные с другими стоп-словами, устаревают
+        self._version = hashlib.sha1("\n".join(sorted(words)).encode("utf-8")).hexdigest()[:16]
+        self._file.mark_loaded()
+        if self.loaded:
+            self.reloads += 1
+        self.loaded = True
+        logger.info(f"Lemma stop words loaded: {len(words)} words")
+
+    @property
+    def words(self) -> frozenset:
+        if not self.loaded or self._file.changed():
+            self.load()
+        return self._words
+
+    @property
+    def version(self) -> str:
+        if not self.loaded or self._file.changed():
+            self.load()
+        return self._version
+
+    def remove(self, lemmas: list) -> list:
+        words = self.words
+        return [lemma for lemma in lemmas if lemma not in words]
+
+    def stats(self) -> dict:
+        return {"entries": len(self._words), "reloads": self.reloads}
+
+
+url_filter = UrlFilter(STOP_WORDS_PATH, FILTERS_RELOAD_INTERVAL)
+lemma_stop_words = LemmaStopWords(CITIES_PATH, FILTERS_RELOAD_INTERVAL)
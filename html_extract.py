@@ -0,0 +1,136 @@
+import asyncio
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from config import EXTRACT_WORKERS, PAGE_MAX_BYTES, PAGE_CONTENT_TYPES
+from logger import logger
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+CHUNK_SIZE = 64 * 1024
+# Причины обрезки тела ответа: предел размера страницы или исчерпанный бюджет анализа
+TRUNCATED_PAGE_LIMIT = "page_limit"
+TRUNCATED_BUDGET = "budget"
+META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+
+# lxml отпускает GIL во время разбора, поэтому потоков достаточно, чтобы не блокировать цикл событий
+executor = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix="html-extract")
+
+
+class ByteBudget:
+    """Сколько байт тел страниц ещё можно прочитать в рамках одного анализа."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.limit - self.used)
+
+
+# Бюджет текущего анализа; задачи загрузки страниц наследуют его из контекста
+request_budget = contextvars.ContextVar("request_budget", default=None)
+
+
+def is_html_response(response) -> bool:
+    """Проверяет Content-Type до чтения тела; ответ без заголовка считается HTML."""
+    if "Content-Type" not in response.headers:
+        return True
+    return response.content_type in PAGE_CONTENT_TYPES
+
+
+def _detect_encoding(chunks, encoding):
+    if encoding:
+        return encoding
+    # Кодировка не пришла в заголовках: ищем meta charset в начале документа
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= 4096:
+            break
+    match = META_CHARSET_RE.search(head)
+    if match:
+        return match.group(1).decode("ascii")
+    return "utf-8"
+
+
+def _extract_with_lxml(chunks, encoding):
+    try:
+        parser = etree.HTMLParser(encoding=encoding, remove_comments=True)
+    except LookupError:
+        parser = etree.HTMLParser(encoding="utf-8", remove_comments=True)
+    # Разбор по частям: страница не склеивается в одну большую строку
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+        root = parser.close()
+    except etree.XMLSyntaxError:
+        # Пустой или нераспознаваемый документ
+        return ""
+    if root is None:
+        return ""
+    etree.strip_elements(root, "script", "style", with_tail=False)
+    return " ".join(root.itertext())
+
+
+def _extract_with_bs4(chunks, encoding):
+    from bs4 import BeautifulSoup
+
+    content = b"".join(chunks).decode(encoding, errors="replace")
+    soup = BeautifulSoup(content, "html.parser")
+    for script_or_style in soup(["script", "style"]):
+        script_or_style.decompose()
+    return soup.get_text(separator=" ")
+
+
+def extract_text(chunks: list, encoding: str = None) -> str:
+    """Извлекает видимый текст страницы из частей HTML-ответа."""
+    encoding = _detect_encoding(chunks, encoding)
+    if etree is not None:
+        page_content = _extract_with_lxml(chunks, encoding)
+    else:
+        page_content = _extract_with_bs4(chunks, encoding)
+    page_content = re.sub(r"\s+", " ", page_content.strip())
+    return page_content.encode("utf-8", errors="replace").decode("utf-8", errors="replace")
+
+
+async def read_limited(response, max_bytes: int = PAGE_MAX_BYTES, budget: ByteBudget = None):
+    """Читает тело ответа частями, не больше max_bytes и остатка бюджета;
+    возвращает части и причину обрезки (TRUNCATED_PAGE_LIMIT, TRUNCATED_BUDGET) или None.
+
+    Бюджет списывается по каждой прочитанной части, так что параллельные загрузки
+    одного анализа вместе не выходят за его предел."""
+    chunks = []
+    size = 0
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        reason = TRUNCATED_PAGE_LIMIT
+        limit = max_bytes - size
+        if budget is not None and budget.remaining < limit:
+            reason = TRUNCATED_BUDGET
+            limit = budget.remaining
+        truncated = len(chunk) > limit
+        if truncated:
+            chunk = chunk[:limit]
+        if chunk:
+            chunks.append(chunk)
+            size += len(chunk)
+            if budget is not None:
+                budget.used += len(chunk)
+        if truncated:
+            logger.warning(f"Page {response.url} truncated at {size} bytes ({reason})")
+            return chunks, reason
+    return chunks, None
+
+
+async def extract_text_async(chunks: list, encoding: str = None) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, extract_text, chunks, encoding)
+
+
+def shutdown():
+    executor.shutdown(wait=True)
@@ -0,0 +1,134 @@
+import asyncio
+import random
+import time
+
+import aiohttp
+
+from config import (HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT,
+                    USER_AGENT_POOL_SIZE)
+from logger import logger
+
+
+class HttpClient:
+    """HTTP-клиент на всё время жизни приложения: общий пул соединений с лимитами и метриками."""
+
+    def __init__(self, limit: int, limit_per_host: int, dns_cache_ttl: int, keepalive_timeout: float):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self._connector = None
+        self._session = None
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.queued = 0
+        self.queue_wait_seconds = 0.0
+
+    def _make_trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            self.requests += 1
+
+        async def on_connection_queued_start(session, context, params):
+            self.queued += 1
+            context.queued_at = time.perf_counter()
+
+        async def on_connection_queued_end(session, context, params):
+            self.queue_wait_seconds += time.perf_counter() - context.queued_at
+
+        async def on_connection_create_end(session, context, params):
+            self.connections_created += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self.connections_reused += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_queued_start.append(on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(on_connection_queued_end)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    def _create_session(self):
+        self._connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self._session = aiohttp.ClientSession(connector=self._connector, trace_configs=[self._make_trace_config()])
+
+    async def start(self):
+        if self._session is not None:
+            return
+        self._create_session()
+        logger.info(f"HTTP client started: limit={self.limit}, limit_per_host={self.limit_per_host}")
+
+    async def close(self):
+        if self._session is None:
+            return
+        session, self._session = self._session, None
+        await session.close()
+        # Даём завершиться закрытию SSL-соединений
+        await asyncio.sleep(0.25)
+        logger.info("HTTP client closed")
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            # Вне приложения (скрипты, бенчмарки) клиент создаётся при первом обращении
+            self._create_session()
+        return self._session
+
+    def stats(self) -> dict:
+        # У TCPConnector нет публичного счётчика занятых соединений, берём его из внутреннего множества
+        in_use = len(getattr(self._connector, "_acquired", ())) if self._connector is not None else 0
+        return {
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "in_use": in_use,
+            "utilization": in_use / self.limit if self.limit else 0.0,
+            "requests": self.requests,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "queued": self.queued,
+            "queue_wait_seconds": self.queue_wait_seconds,
+        }
+
+
+class UserAgentPool:
+    """Набор User-Agent для загрузки страниц, выбираемый из базы fake_useragent один раз за время работы."""
+
+    # Если база браузеров недоступна, страницы загружаются с одним распространённым User-Agent
+    FALLBACK = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                "Chrome/124.0.0.0 Safari/537.36")
+
+    def __init__(self, size: int):
+        self.size = size
+        self._agents = []
+
+    def load(self):
+        if self._agents:
+            return
+        try:
+            from fake_useragent import UserAgent
+
+            ua = UserAgent()
+            agents = list({ua.random for _ in range(self.size)})
+        except Exception as e:
+            logger.warning(f"User-Agent database is not available, using a fallback: {e}")
+            agents = [self.FALLBACK]
+        self._agents = agents
+        logger.info(f"User-Agent pool loaded: {len(agents)} agents")
+
+    def random(self) -> str:
+        if not self._agents:
+            self.load()
+        return random.choice(self._agents)
+
+
+http_client = HttpClient(HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT)
+user_agents = UserAgentPool(USER_AGENT_POOL_SIZE)
@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from starlette.background import BackgroundTasks
+
+from analysis import analyze_request
+from config import JOB_CONCURRENCY, JOB_QUEUE_SIZE, JOB_RESULT_TTL, JOB_HEARTBEAT_INTERVAL, JOB_INSTANCE_TTL
+from logger import logger
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+UNFINISHED = [QUEUED, RUNNING]
+
+# Экземпляр приложения: новый при каждом запуске процесса, даже если pid совпал с прежним
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def job_to_dict(job) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+    }
+
+
+def make_params_key(provider: str, url: str, search_string: str, region: str, domain: str) -> str:
+    params = json.dumps([provider, url, search_string, region, domain], ensure_ascii=False)
+    return hashlib.sha1(params.encode("utf-8")).hexdigest()
+
+
+class JobManager:
+    """Очередь заданий анализа с ограниченным числом воркеров; состояние заданий хранится в БД."""
+
+    def __init__(self, concurrency: int, queue_size: int, result_ttl: int, heartbeat_interval: float,
+                 instance_ttl: float):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.result_ttl = result_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.instance_ttl = instance_ttl
+        # Перезапускает ли этот процесс брошенные задания (в нескольких воркерах — только владелец записи в БД)
+        self._resumes = False
+        self._database = None
+        self._queue = None
+        self._workers = []
+        self._submit_lock = None
+        # Задания, ожидающие выполнения в этом процессе: ключ параметров -> id задания
+        self._active = {}
+        self._finished = {}
+
+    async def start(self, database, resume: bool = True):
+        """Запускает воркеры заданий; resume — перезапустить задания, не завершённые до остановки.
+
+        При нескольких процессах приложения их перезапускает только владелец записи в БД
+        через resume(), иначе каждое задание выполнилось бы по разу в каждом процессе.
+        """
+        if self._workers:
+            return
+        self._database = database
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._submit_lock = asyncio.Lock()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        # Отметка появляется до первого перезапуска: иначе другие процессы сочли бы задания этого брошенными
+        await database.heartbeat(INSTANCE_ID)
+        self._workers.append(asyncio.create_task(self._heartbeat()))
+        if resume:
+            await self.resume()
+        logger.info(f"Job manager started: concurrency={self.concurrency}, queue_size={self.queue_size}")
+
+    async def resume(self):
+        """Ставит в очередь незавершённые задания экземпляров приложения, которые больше не отмечаются.
+
+        Задания живых экземпляров не трогаем: их выполняет экземпляр, который их принял. После вызова
+        брошенные задания перезапускаются и дальше, с каждой отметкой этого процесса.
+        """
+        self._resumes = True
+        live = await self._database.get_live_instances(datetime.now() - timedelta(seconds=self.instance_ttl))
+        abandoned = [job for job in await self._database.get_jobs_by_status(UNFINISHED)
+                     if job.id not in self._finished and job.instance_id not in live]
+        # Задание забирается условным UPDATE: при нескольких экземплярах его перезапустит только один
+        unfinished = [job for job in abandoned
+                      if await self._database.claim_job(job.id, job.instance_id, INSTANCE_ID)]
+        for job in unfinished:
+            self._track(job.id, job.params_key)
+        if unfinished:
+            logger.info(f"Resuming {len(unfinished)} unfinished jobs")
+            self._workers.append(asyncio.create_task(self._requeue(unfinished)))
+
+    async def stop(self):
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if self._database is not None:
+            # Незавершённые задания этого процесса сразу переходят к другим, не дожидаясь JOB_INSTANCE_TTL
+            try:
+                await self._database.remove_instance(INSTANCE_ID)
+            except Exception as e:
+                logger.error(f"Error removing job manager instance: {e}")
+        logger.info("Job manager stopped")
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self._database.heartbeat(INSTANCE_ID)
+                if self._resumes:
+                    await self.resume()
+            except Exception as e:
+                logger.error(f"Job manager heartbeat failed: {e}")
+
+    def stats(self) -> dict:
+        return {"queued_now": self._queue.qsize() if self._queue is not None else 0}
+
+    async def _requeue(self, jobs: list):
+        for job in jobs:
+            await self._queue.put((job.id, job.request_id, job.provider, job.params_key))
+            logger.info(f"Job {job.id} is requeued after its instance stopped")
+
+    def _track(self, job_id: str, params_key: str):
+        self._active[params_key] = job_id
+        self._finished[job_id] = asyncio.Event()
+
+    async def submit(self, provider: str, url: str, search_string: str, region: str, domain: str) -> str:
+        """Ставит анализ в очередь и возвращает id задания; повторная отправка получает существующее задание."""
+        params_key = make_params_key(provider, url, search_string, region, domain)
+        # Проверка и создание задания под блокировкой, чтобы одновременные дубликаты не создали два задания
+        async with self._submit_lock:
+            job_id = self._active.get(params_key)
+            if job_id is not None:
+                return job_id
+            date_from = datetime.now() - timedelta(seconds=self.result_ttl)
+            job = await self._database.find_job(params_key, UNFINISHED + [DONE], date_from)
+            if job is not None:
+                logger.info(f"Job {job.id} reused for repeated submission")
+                return job.id
+            if self._queue.full():
+                raise JobQueueFull()
+            db_request = await self._database.save_request(url, search_string, region, domain)
+            job_id = uuid.uuid4().hex
+            await self._database.create_job(job_id, db_request.id, provider, params_key, QUEUED, INSTANCE_ID)
+            self._track(job_id, params_key)
+            self._queue.put_nowait((job_id, db_request.id, provider, params_key))
+            return job_id
+
+    async def wait(self, job_id: str, timeout: float) -> bool:
+        """Ждёт завершения задания не дольше timeout секунд; возвращает True, если стоит перечитать статус."""
+        event = self._finished.get(job_id)
+        if event is None:
+            # Задание выполняется не в этом процессе или уже завершено: опрашиваем БД с паузой
+            await asyncio.sleep(min(timeout, 1))
+            return True
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _run(self, job_id: str, request_id: int, provider: str):
+        await self._database.update_job(job_id, RUNNING, instance_id=INSTANCE_ID)
+        db_request = await self._database.get_request(request_id)
+        background_tasks = BackgroundTasks()
+        response = await analyze_request(self._database, background_tasks, db_request, provider)
+        await self._database.update_job(job_id, DONE, result=json.dumps(response, ensure_ascii=False))
+        # Сохранение результатов выполняем после публикации ответа, как фоновые задачи FastAPI
+        await background_tasks()
+
+    async def _worker(self):
+        while True:
+            job_id, request_id, provider, params_key = await self._queue.get()
+            try:
+                await self._run(job_id, request_id, provider)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}")
+                try:
+                    await self._database.update_job(job_id, FAILED, error=str(e))
+                except Exception as update_error:
+                    logger.error(f"Error marking job {job_id} as failed: {update_error}")
+            finally:
+                self._queue.task_done()
+                if self._active.get(params_key) == job_id:
+                    del self._active[params_key]
+                event = self._finished.pop(job_id, None)
+                if event is not None:
+                    event.set()
+
+
+job_manager = JobManager(JOB_CONCURRENCY, JOB_QUEUE_SIZE, JOB_RESULT_TTL, JOB_HEARTBEAT_INTERVAL,
+                         JOB_INSTANCE_TTL)
@@ -0,0 +1,109 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+from config import LEMMA_CACHE_PATH, LEMMA_CACHE_MAX_ENTRIES, LEMMA_MAX_TOKENS
+from logger import logger
+
+# Версия формата кэша: при изменении очистки текста, лемматизации или ограничения
+# числа слов документа старые записи перестают совпадать
+CACHE_VERSION = f"2.{LEMMA_MAX_TOKENS}"
+
+
+class LemmaCache:
+    """Кэш лемм на локальном диске, адресуемый хэшем текста страницы, с вытеснением LRU."""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=15, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS lemma_cache ("
+                "key TEXT PRIMARY KEY, lemmas TEXT NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_lemma_cache_accessed_at ON lemma_cache (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def warm_up(self):
+        """Открывает соединение с файлом кэша заранее, чтобы первый запрос не ждал создания таблиц."""
+        with self._lock:
+            self._connect()
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        """Возвращает ключ кэша для текста страницы."""
+        digest = hashlib.sha1(text.encode("utf-8", errors="replace")).hexdigest()
+        return f"{CACHE_VERSION}:{digest}"
+
+    def get_many(self, keys: list) -> dict:
+        """Возвращает найденные в кэше списки лемм по ключам и обновляет время доступа к ним."""
+        unique_keys = list(set(keys))
+        if not unique_keys:
+            return {}
+        found = {}
+        try:
+            with self._lock:
+                conn = self._connect()
+                for i in range(0, len(unique_keys), 500):
+                    chunk = unique_keys[i:i + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = conn.execute(
+                        f"SELECT key, lemmas FROM lemma_cache WHERE key IN ({placeholders})", chunk
+                    ).fetchall()
+                    found.update({key: lemmas.split(" ") if lemmas else [] for key, lemmas in rows})
+                if found:
+                    now = time.time()
+                    conn.executemany("UPDATE lemma_cache SET accessed_at = ? WHERE key = ?",
+                                     [(now, key) for key in found])
+                    conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error reading lemma cache: {e}")
+            found = {}
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items: dict):
+        """Сохраняет списки лемм по ключам и вытесняет давно не использованные записи."""
+        if not items:
+            return
+        try:
+            with self._lock:
+                conn = self._connect()
+                now = time.time()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO lemma_cache (key, lemmas, accessed_at) VALUES (?, ?, ?)",
+                    [(key, " ".join(lemmas), now) for key, lemmas in items.items()]
+                )
+                overflow = conn.execute("SELECT COUNT(*) FROM lemma_cache").fetchone()[0] - self.max_entries
+                if overflow > 0:
+                    conn.execute(
+                        "DELETE FROM lemma_cache WHERE key IN "
+                        "(SELECT key FROM lemma_cache ORDER BY accessed_at LIMIT ?)", (overflow,)
+                    )
+                    logger.info(f"Lemma cache evicted {overflow} entries")
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error writing lemma cache: {e}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+lemma_cache = LemmaCache(LEMMA_CACHE_PATH, LEMMA_CACHE_MAX_ENTRIES)
@@ -1,21 +1,138 @@
+import asyncio
+import fcntl
+import json
+import os
+import tempfile
+import time
+from typing import List
+
 from fastapi import FastAPI, Query, HTTPException, BackgroundTasks
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from pydantic import BaseModel
 
-from config import DATABASE_URL
+import html_extract
+from analysis import analyze_request, analyze_batch, YANDEX, GOOGLE
+from competitor_profile import competitor_profiles
+from config import (DATABASE_URL, WRITE_BEHIND_ENABLED, WRITE_SPOOL_ENABLED, BATCH_MAX_ITEMS, BATCH_CONCURRENCY,
+                    WORKERS)
 from db_utils import Database
+from fetch_scheduler import fetch_scheduler
+from filters import url_filter, lemma_stop_words
 from logger import logger
-from utils import process_search_results, yandex_xmlproxy_request, google_proxy_request
+from http_client import http_client, user_agents
+from jobs import job_manager, job_to_dict, JobQueueFull, DONE, FAILED
+from lemma_cache import lemma_cache
+from metrics import stats_collector, render, CONTENT_TYPE_LATEST
+from mystem_pool import mystem_pool
+from term_frequency import compare_frequencies
+from page_cache import page_cache
+from serp_cache import serp_cache
+from shared_cache import shared_cache
+from write_queue import write_queue, write_spool
 
 from datetime import datetime, timedelta
 
+# Одно подключение к базе с общим пулом соединений на всё приложение
+database = Database(DATABASE_URL)
+
+# Счётчики кэшей, пулов и очередей читаются при каждом опросе /metrics
+stats_collector.register("http_pool", http_client.stats)
+stats_collector.register("db_pool", database.pool_stats)
+stats_collector.register("mystem_pool", mystem_pool.stats)
+stats_collector.register("page_cache", page_cache.stats)
+stats_collector.register("serp_cache", serp_cache.stats)
+stats_collector.register("lemma_cache", lemma_cache.stats)
+stats_collector.register("competitor_profiles", competitor_profiles.stats)
+stats_collector.register("fetch_scheduler", fetch_scheduler.stats)
+stats_collector.register("url_filter", url_filter.stats)
+stats_collector.register("lemma_stop_words", lemma_stop_words.stats)
+stats_collector.register("write_queue", write_queue.stats)
+stats_collector.register("write_spool", write_spool.stats)
+stats_collector.register("shared_cache", shared_cache.stats)
+stats_collector.register("job_queue", job_manager.stats)
+
+
+# Готовность принимать запросы и время этапов прогрева для /health/ready
+startup_state = {"ready": False, "warm_up": {}}
+
+
+async def timed(name: str, awaitable):
+    started = time.perf_counter()
+    result = await awaitable
+    startup_state["warm_up"][name] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def load_filters():
+    # Стоп-слова читаются один раз до приёма запросов, дальше файлы перечитываются только после изменения
+    url_filter.load()
+    lemma_stop_words.load()
+
+
+async def create_tables():
+    if WORKERS == 1:
+        await database.create_all()
+        return
+    # Воркеры стартуют одновременно: таблицы создаются и мигрируются ими по очереди
+    loop = asyncio.get_running_loop()
+    with open(os.path.join(tempfile.gettempdir(), "autorelevant-schema.lock"), "a") as lock_file:
+        await loop.run_in_executor(None, fcntl.flock, lock_file, fcntl.LOCK_EX)
+        try:
+            await database.create_all()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+async def warm_up():
+    """Готовит всё, что иначе досталось бы первому запросу: воркеры Mystem, словари, кэши и пулы потоков."""
+    loop = asyncio.get_running_loop()
+    # Процессы Mystem запускаются до остальных шагов прогрева: fork не должен застать работающие потоки
+    await timed("mystem_pool", mystem_pool.start())
+    await asyncio.gather(
+        timed("database", create_tables()),
+        timed("filters", loop.run_in_executor(None, load_filters)),
+        timed("user_agents", loop.run_in_executor(None, user_agents.load)),
+        timed("lemma_cache", loop.run_in_executor(None, lemma_cache.warm_up)),
+        timed("shared_cache", loop.run_in_executor(None, shared_cache.warm_up)),
+        timed("html_extract", html_extract.extract_text_async([b"<html><body><p>warm-up</p></body></html>"])),
+        timed("frequency", loop.run_in_executor(None, compare_frequencies, ["warm"], [["warm", "up"]])),
+    )
+
+
 async def startup():
-    # Создание таблиц, если они еще не созданы
-    database = Database(DATABASE_URL)
-    await database.create_all()
+    started = time.perf_counter()
+    await warm_up()
+    # Общий пул HTTP-соединений на всё время жизни приложения
+    await http_client.start()
+    if WRITE_SPOOL_ENABLED:
+        # Записью в БД владеет один процесс; он же перезапускает брошенные задания,
+        # в том числе когда становится владельцем после остановки прежнего
+        await job_manager.start(database, resume=False)
+        await write_spool.start(database, on_acquire=job_manager.resume)
+    else:
+        if WRITE_BEHIND_ENABLED:
+            await write_queue.start(database)
+        await job_manager.start(database)
+    startup_state["ready"] = True
+    logger.info(f"Startup finished in {time.perf_counter() - started:.2f}s, warm-up: {startup_state['warm_up']}")
+
+
+async def shutdown():
+    # Новые запросы на время остановки не принимаются: балансировщик уводит трафик по /health/ready
+    startup_state["ready"] = False
+    await job_manager.stop()
+    await write_queue.stop()
+    await write_spool.stop()
+    await http_client.close()
+    await mystem_pool.shutdown()
+    html_extract.shutdown()
+    await database.close()
 
 
 # FastAPI app
 app = FastAPI()
 app.add_event_handler("startup", startup)
+app.add_event_handler("shutdown", shutdown)
 
 
 @app.get("/process-url/")
@@ -23,22 +140,8 @@ async def process_url(background_tasks: BackgroundTasks, url: str = Query(...),
                       region: str = Query(...)):
     """Получает параметры запроса, сохраняет их и отправляет на обработку."""
     try:
-        database = Database(DATABASE_URL)
         db_request = await database.save_request(url, search_string, region, '')
-        search_results = await yandex_xmlproxy_request(search_string=search_string, region=region)
-        if search_results is not None:
-            decrease_qty, filtered_urls, increase_qty, lsi = await process_search_results(background_tasks, database,
-                                                                                          db_request, search_results,
-                                                                                          url)
-
-        return {"status": "success",
-                'lsi': [key for key in lsi.keys()] if not lsi.empty else [],
-                'увеличить частотность': [f"{key}: {value}" for key, value in
-                                          increase_qty.items()] if not increase_qty.empty else [],
-                'уменьшить частотность': [f"{key}: {value}" for key, value in
-                                          decrease_qty.items()] if not decrease_qty.empty else [],
-                'обработанные ссылки': {i: page_url for i, page_url in filtered_urls.items() if page_url != url}
-                }
+        return await analyze_request(database, background_tasks, db_request, YANDEX)
 
     except Exception as e:
         logger.error(f"Error processing request: {e}")
@@ -50,32 +153,97 @@ async def search_google(background_tasks: BackgroundTasks, url: str = Query(...)
                         domain: str = Query(...)):
     """Получает параметры запроса, сохраняет их и отправляет на обработку."""
     try:
-        database = Database(DATABASE_URL)
         db_request = await database.save_request(url, search_string, location, domain)
-        search_results = await google_proxy_request(search_string=search_string, location=location, domain=domain)
-        if search_results is not None:
-            decrease_qty, filtered_urls, increase_qty, lsi = await process_search_results(background_tasks, database,
-                                                                                          db_request, search_results,
-                                                                                          url)
-        return {"status": "success",
-                'lsi': [key for key in lsi.keys()] if not lsi.empty else [],
-                'увеличить частотность': [f"{key}: {value}" for key, value in
-                                          increase_qty.items()] if not increase_qty.empty else [],
-                'уменьшить частотность': [f"{key}: {value}" for key, value in
-                                          decrease_qty.items()] if not decrease_qty.empty else [],
-                'обработанные ссылки': {i: page_url for i, page_url in filtered_urls.items() if page_url != url}
-                }
+        return await analyze_request(database, background_tasks, db_request, GOOGLE)
 
     except Exception as e:
         logger.error(f"Error processing request: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+async def submit_job(provider: str, url: str, search_string: str, region: str, domain: str):
+    try:
+        job_id = await job_manager.submit(provider, url, search_string, region, domain)
+        return {"status": "accepted", "job_id": job_id}
+    except JobQueueFull:
+        raise HTTPException(status_code=503, detail="Job queue is full")
+    except Exception as e:
+        logger.error(f"Error submitting job: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.post("/jobs/process-url/", status_code=202)
+async def submit_process_url(url: str = Query(...), search_string: str = Query(...), region: str = Query(...)):
+    """Ставит анализ по выдаче Яндекса в очередь и сразу возвращает id задания."""
+    return await submit_job(YANDEX, url, search_string, region, '')
+
+
+@app.post("/jobs/search-google/", status_code=202)
+async def submit_search_google(url: str = Query(...), search_string: str = Query(...), location: str = Query(...),
+                               domain: str = Query(...)):
+    """Ставит анализ по выдаче Google в очередь и сразу возвращает id задания."""
+    return await submit_job(GOOGLE, url, search_string, location, domain)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Возвращает статус задания и результат, если он готов."""
+    job = await database.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_to_dict(job)
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Передаёт изменения статуса задания через Server-Sent Events до его завершения."""
+    job = await database.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def stream():
+        last_status = None
+        while True:
+            job = await database.get_job(job_id)
+            if job.status != last_status:
+                last_status = job.status
+                yield f"event: status\ndata: {json.dumps(job_to_dict(job), ensure_ascii=False)}\n\n"
+            if job.status in (DONE, FAILED):
+                break
+            if not await job_manager.wait(job_id, timeout=15):
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+class BatchItem(BaseModel):
+    url: str
+    search_string: str
+    region: str
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+
+
+@app.post("/process-batch/")
+async def process_batch(batch: BatchRequest):
+    """Анализирует список (url, search_string, region) и возвращает результаты в формате NDJSON по мере готовности."""
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {BATCH_MAX_ITEMS} items")
+    items = [item.dict() for item in batch.items]
+
+    async def stream():
+        async for item_result in analyze_batch(database, items, BATCH_CONCURRENCY):
+            yield json.dumps(item_result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
 @app.get("/result-lsi/")
 async def result_lsi(url: str = Query(...)):
     """Возвращает все слова lsi с числом встречаемости для запросов, где URL похож на передаваемый."""
     try:
-        database = Database(DATABASE_URL)
         # Определяем дату 30 дней назад
         date_30_days_ago = datetime.now() - timedelta(days=30)
         lsi_words = await database.get_lsi_words(url, date_30_days_ago)
@@ -86,7 +254,32 @@ async def result_lsi(url: str = Query(...)):
         logger.error(f"Error processing LSI words request: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+
+@app.get("/health/live")
+async def health_live():
+    """Процесс запущен и обрабатывает запросы."""
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+async def health_ready():
+    """Прогрев завершён и приложение готово к анализу; иначе 503."""
+    if not startup_state["ready"]:
+        return JSONResponse(status_code=503, content={"status": "starting", "warm_up": startup_state["warm_up"]})
+    return {"status": "ready", "warm_up": startup_state["warm_up"]}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики приложения в формате Prometheus."""
+    return Response(content=render(), media_type=CONTENT_TYPE_LATEST)
+
+
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host='0.0.0.0', port=5000)
+    # Несколько воркеров uvicorn запускает только по строке импорта приложения
+    if WORKERS > 1:
+        uvicorn.run("main:app", host='0.0.0.0', port=5000, workers=WORKERS)
+    else:
+        uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -0,0 +1,147 @@
+import contextvars
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from config import TRACE_REQUESTS, TRACE_MEMORY
+from logger import logger
+
+# Границы корзин в секундах: от разбора одной страницы до полного анализа выдачи
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+STAGE_SECONDS = Histogram("autorelevant_stage_seconds", "Время выполнения этапов анализа", ["stage"],
+                          buckets=STAGE_BUCKETS)
+REQUESTS = Counter("autorelevant_requests_total", "Анализы запросов по поисковику и результату",
+                   ["provider", "status"])
+PAGE_FETCHES = Counter("autorelevant_page_fetches_total", "Загрузки страниц по результату", ["result"])
+# Рост RSS процесса за этап, байты; при параллельных запросах включает и их память
+STAGE_RSS_GROWTH = Histogram("autorelevant_stage_rss_growth_bytes", "Рост RSS процесса за этап", ["stage"],
+                             buckets=tuple(2 ** power for power in range(16, 32, 2)))
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Этапы текущего запроса для трассировки в лог; None, если запрос не трассируется
+_spans = contextvars.ContextVar("spans", default=None)
+
+
+def current_rss() -> int:
+    """Текущий RSS процесса в байтах; 0, если /proc недоступен."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def peak_rss() -> int:
+    # ru_maxrss в Linux в килобайтах, в macOS — в байтах
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@contextmanager
+def stage(name: str):
+    """Замеряет время этапа в гистограмму и добавляет его в трассировку текущего запроса.
+
+    При TRACE_MEMORY замеряется и рост RSS процесса за этап.
+    """
+    started = time.perf_counter()
+    rss_before = current_rss() if TRACE_MEMORY else 0
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        growth = None
+        if TRACE_MEMORY and rss_before:
+            growth = max(0, current_rss() - rss_before)
+            STAGE_RSS_GROWTH.labels(name).observe(growth)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((name, elapsed, growth))
+
+
+@contextmanager
+def request_trace(provider: str, request_id):
+    """Замеряет полный анализ запроса; при TRACE_REQUESTS пишет в лог время всех его этапов."""
+    spans = [] if TRACE_REQUESTS else None
+    token = _spans.set(spans)
+    status = "error"
+    try:
+        with stage("request"):
+            yield
+        status = "success"
+    finally:
+        _spans.reset(token)
+        REQUESTS.labels(provider, status).inc()
+        if spans:
+            logger.info(f"Trace request {request_id} ({status}): {format_spans(spans)}")
+
+
+def format_spans(spans: list) -> str:
+    # Повторяющиеся этапы (загрузка каждой страницы) сворачиваются в число, сумму и максимум
+    totals = {}
+    for name, elapsed, growth in spans:
+        count, total, longest, max_growth = totals.get(name, (0, 0.0, 0.0, None))
+        if growth is not None:
+            max_growth = max(max_growth or 0, growth)
+        totals[name] = (count + 1, total + elapsed, max(longest, elapsed), max_growth)
+    parts = []
+    for name, (count, total, longest, max_growth) in totals.items():
+        if count == 1:
+            part = f"{name}={total:.3f}s"
+        else:
+            part = f"{name}={count}x{total / count:.3f}s(max {longest:.3f}s)"
+        if max_growth is not None:
+            part += f"+{max_growth / 2 ** 20:.1f}MB"
+        parts.append(part)
+    return " ".join(parts)
+
+
+class StatsCollector:
+    """Отдаёт счётчики компонентов (кэши, пулы, очереди) по их методам stats() в момент опроса."""
+
+    # Мгновенные значения; остальные ключи stats() — монотонные счётчики
+    GAUGES = {"entries", "limit", "limit_per_host", "in_use", "utilization", "hit_rate", "size", "pending",
+              "max_pending", "queued_now", "checked_out", "overflow", "pending_rows", "hosts", "writer",
+              "rss_bytes", "peak_rss_bytes", "size_bytes"}
+
+    def __init__(self):
+        self._sources = {}
+
+    def register(self, name: str, stats):
+        self._sources[name] = stats
+
+    def collect(self):
+        for name, stats in self._sources.items():
+            try:
+                values = stats()
+            except Exception as e:
+                logger.error(f"Error collecting {name} metrics: {e}")
+                continue
+            for key, value in values.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                metric = f"autorelevant_{name}_{key}"
+                if key in self.GAUGES:
+                    yield GaugeMetricFamily(metric, f"{name}: {key}", value=value)
+                else:
+                    yield CounterMetricFamily(metric, f"{name}: {key}", value=value)
+
+
+def process_stats() -> dict:
+    return {"rss_bytes": current_rss(), "peak_rss_bytes": peak_rss()}
+
+
+stats_collector = StatsCollector()
+stats_collector.register("process", process_stats)
+REGISTRY.register(stats_collector)
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
@@ -0,0 +1,152 @@
+import asyncio
+import itertools
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from pymystem3 import Mystem
+
+from config import MYSTEM_POOL_SIZE, MYSTEM_POOL_MAX_PENDING, MYSTEM_BATCH_MAX_CHARS, LEMMA_MAX_TOKENS
+from logger import logger
+
+# Экземпляр Mystem создаётся в каждом процессе-воркере один раз при его запуске
+mystem = None
+
+# Латинское служебное слово Mystem возвращает без изменений, по нему пачка делится обратно на документы
+DOC_SEPARATOR = "zzdocbreakzz"
+DOC_SEPARATOR_RE = re.compile(rf"\b{DOC_SEPARATOR}\b")
+# Всё, кроме букв, заменяется пробелом; цифры при этом тоже удаляются
+NON_LETTERS_RE = re.compile(r"[^а-яА-ЯёЁa-zA-Z]+")
+WORD_RE = re.compile(r"[а-яА-ЯёЁa-zA-Z]+")
+
+
+def _init_worker():
+    global mystem
+    mystem = Mystem()
+    # Прогрев: первый вызов запускает бинарник mystem
+    mystem.lemmatize("прогрев")
+
+
+def _warm_up():
+    return True
+
+
+def _clean_text(text):
+    return NON_LETTERS_RE.sub(" ", text).lower()
+
+
+def truncate_tokens(text, max_tokens=LEMMA_MAX_TOKENS):
+    """Оставляет в тексте первые max_tokens слов; просматривается только эта часть текста."""
+    if max_tokens <= 0 or len(text) <= max_tokens:
+        return text
+    last = None
+    for last in itertools.islice(WORD_RE.finditer(text), max_tokens - 1, max_tokens):
+        pass
+    return text if last is None else text[:last.end()]
+
+
+def _is_significant(lemma):
+    # Оставляем только значимые токены, стоп-слова отбрасываются отдельно
+    return lemma.strip() and len(lemma) > 2
+
+
+def mystem_lemmatize(text):
+    if mystem is None:
+        _init_worker()
+    lemmas = mystem.lemmatize(_clean_text(truncate_tokens(text)))
+    return [lemma for lemma in lemmas if _is_significant(lemma)]
+
+
+def mystem_lemmatize_batch(texts):
+    """Лемматизирует несколько документов одним вызовом Mystem, разделяя их служебным словом."""
+    if mystem is None:
+        _init_worker()
+    # Служебное слово не может встретиться в тексте: убираем его из документов перед склейкой
+    cleaned = [DOC_SEPARATOR_RE.sub(" ", _clean_text(text)) for text in texts]
+    lemmas = mystem.lemmatize(f" {DOC_SEPARATOR} ".join(cleaned))
+    documents = [[]]
+    for lemma in lemmas:
+        if lemma == DOC_SEPARATOR:
+            documents.append([])
+        elif _is_significant(lemma):
+            documents[-1].append(lemma)
+    if len(documents) != len(texts):
+        # Разделитель потерялся при анализе: обрабатываем документы по одному
+        logger.warning(f"Mystem batch split mismatch: {len(documents)} parts for {len(texts)} documents")
+        return [mystem_lemmatize(text) for text in texts]
+    return documents
+
+
+class MystemPool:
+    """Долгоживущий пул процессов с прогретыми экземплярами Mystem, общий для всех запросов."""
+
+    def __init__(self, size: int, max_pending: int, batch_max_chars: int):
+        self.size = size
+        self.max_pending = max_pending
+        self.batch_max_chars = batch_max_chars
+        self._executor = None
+        self._semaphore = None
+        self.pending = 0
+        self.batches = 0
+
+    async def start(self):
+        if self._executor is not None:
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.size, initializer=_init_worker)
+        self._semaphore = asyncio.Semaphore(self.max_pending)
+        loop = asyncio.get_running_loop()
+        # Запускаем все процессы заранее, чтобы первый запрос не ждал старта mystem
+        await asyncio.gather(*[loop.run_in_executor(self._executor, _warm_up) for _ in range(self.size)])
+        logger.info(f"Mystem pool started with {self.size} workers")
+
+    async def shutdown(self):
+        if self._executor is None:
+            return
+        executor, self._executor = self._executor, None
+        loop = asyncio.get_running_loop()
+        # Дожидаемся завершения уже отправленных документов
+        await loop.run_in_executor(None, executor.shutdown, True)
+        logger.info("Mystem pool stopped")
+
+    async def _submit(self, texts):
+        # Семафор ограничивает очередь: при переполнении запросы ждут освобождения места
+        self.pending += 1
+        try:
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, mystem_lemmatize_batch, texts)
+        finally:
+            self.pending -= 1
+            self.batches += 1
+
+    def _make_batches(self, texts):
+        # Склеиваем документы подряд, пока пачка не превысит лимит по числу символов
+        batches, batch, batch_chars = [], [], 0
+        for text in texts:
+            if batch and batch_chars + len(text) > self.batch_max_chars:
+                batches.append(batch)
+                batch, batch_chars = [], 0
+            batch.append(text)
+            batch_chars += len(text)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def lemmatize_many(self, texts: list) -> list:
+        """Лемматизирует документы пачками в воркерах пула и возвращает списки лемм в исходном порядке."""
+        if self._executor is None:
+            await self.start()
+        # Длинные документы обрезаются до отправки: в воркер передаётся только нужная часть текста
+        texts = [truncate_tokens(text) for text in texts]
+        results = await asyncio.gather(*[self._submit(batch) for batch in self._make_batches(texts)])
+        return [lemmas for batch_result in results for lemmas in batch_result]
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "batches": self.batches,
+        }
+
+
+mystem_pool = MystemPool(MYSTEM_POOL_SIZE, MYSTEM_POOL_MAX_PENDING, MYSTEM_BATCH_MAX_CHARS)
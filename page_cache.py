@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+from config import PAGE_CACHE_TTL
+
+
+class PageCache:
+    """Правила кэширования загруженных страниц и статистика попаданий; сами страницы хранятся в БД."""
+
+    def __init__(self, ttl: int):
+        self.ttl = timedelta(seconds=ttl)
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def is_fresh(self, page) -> bool:
+        return page is not None and datetime.now() - page.fetched_at < self.ttl
+
+    @staticmethod
+    def conditional_headers(page) -> dict:
+        """Заголовки условного GET-запроса по сохранённым валидаторам."""
+        headers = {}
+        if page is None:
+            return headers
+        if page.etag:
+            headers['If-None-Match'] = page.etag
+        if page.last_modified:
+            headers['If-Modified-Since'] = page.last_modified
+        return headers
+
+    @staticmethod
+    def make_entry(url: str, content: str, headers) -> dict:
+        return {
+            'url': url,
+            'content': content,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'fetched_at': datetime.now(),
+        }
+
+    def stats(self) -> dict:
+        total = self.hits + self.revalidated + self.misses
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.revalidated) / total if total else 0.0,
+        }
+
+
+page_cache = PageCache(PAGE_CACHE_TTL)
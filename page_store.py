@@ -0,0 +1,95 @@
+import hashlib
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Новые блоки сжимаются zstd, если пакет установлен; кодек хранится вместе с блоком
+DEFAULT_CODEC = "zstd" if zstandard is not None else "zlib"
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8", errors="replace")).hexdigest()
+
+
+def compress(content: str, codec: str = DEFAULT_CODEC) -> bytes:
+    data = content.encode("utf-8", errors="replace")
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=9).compress(data)
+    return zlib.compress(data, 6)
+
+
+def decompress(data: bytes, codec: str) -> str:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Page is compressed with zstd, install the zstandard package to read it")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        data = zlib.decompress(data)
+    return data.decode("utf-8", errors="replace")
+
+
+def hash_page_contents(rows: list):
+    """Заменяет текст в строках ссылкой content_hash; возвращает новые строки и тексты по хэшам."""
+    hashed_rows = []
+    texts = {}
+    for row in rows:
+        if 'content' not in row:
+            # Текст уже сохранён раньше, в строке только ссылка на него
+            hashed_rows.append(row)
+            continue
+        digest = content_hash(row['content'])
+        texts[digest] = row['content']
+        hashed_row = {key: value for key, value in row.items() if key != 'content'}
+        hashed_row['content_hash'] = digest
+        hashed_rows.append(hashed_row)
+    return hashed_rows, texts
+
+
+def pack_blobs(texts: dict) -> list:
+    """Сжимает тексты в строки page_blobs."""
+    return [{'hash': digest, 'codec': DEFAULT_CODEC, 'data': compress(text), 'size': len(text)}
+            for digest, text in texts.items()]
+
+
+def pack_page_contents(rows: list):
+    """Заменяет текст страниц ссылкой на хэш и возвращает строки page_content и сжатые блоки."""
+    page_rows, texts = hash_page_contents(rows)
+    return page_rows, pack_blobs(texts)
+
+
+class StoredPage:
+    """Сохранённая страница; текст распаковывается только при первом обращении к content."""
+
+    def __init__(self, url: str, content_hash: str, codec: str, data: bytes, content: str = None):
+        self.url = url
+        self.content_hash = content_hash
+        self._codec = codec
+        self._data = data
+        self._content = content
+
+    @property
+    def content(self) -> str:
+        if self._content is None:
+            self._content = decompress(self._data, self._codec)
+            self._data = None
+        return self._content
+
+
+class StoredCachedPage(StoredPage):
+    """Страница кэша загрузок с валидаторами условного GET; текст хранится в page_blobs."""
+
+    def __init__(self, url: str, content_hash: str, codec: str, data: bytes, etag: str, last_modified: str,
+                 fetched_at, content: str = None):
+        super().__init__(url, content_hash, codec, data, content)
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+    @classmethod
+    def from_entry(cls, entry: dict):
+        """Страница из записи кэша в памяти, где текст ещё не сжат."""
+        return cls(entry['url'], None, None, None, entry['etag'], entry['last_modified'], entry['fetched_at'],
+                   entry['content'])
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from config import SERP_CACHE_TTL, SERP_CACHE_MAX_ENTRIES
+from logger import logger
+from shared_cache import shared_cache
+
+
+class SerpCache:
+    """Кэш поисковой выдачи с объединением одинаковых одновременных запросов.
+
+    Ключ — (search_string, region, domain); для Яндекса domain пустой, как в таблице requests.
+    Сначала проверяется память, затем общий для воркеров кэш, таблица search_results,
+    и только потом поисковый API.
+    """
+
+    def __init__(self, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self.hits = 0
+        self.shared_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _get_local(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _put_local(self, key, result):
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _shared_key(key) -> str:
+        return json.dumps(key, ensure_ascii=False)
+
+    async def _load(self, key, fetch, database):
+        loop = asyncio.get_running_loop()
+        if shared_cache.enabled:
+            result = await loop.run_in_executor(None, shared_cache.get, "serp", self._shared_key(key))
+            if result:
+                self.shared_hits += 1
+                self._put_local(key, result)
+                return result, True
+        if database is not None:
+            date_from = datetime.now() - timedelta(seconds=self.ttl)
+            result = await database.get_recent_search_results(*key, date_from)
+            if result:
+                self.db_hits += 1
+                self._put_local(key, result)
+                return result, True
+        self.misses += 1
+        result = await fetch()
+        if result:
+            self._put_local(key, result)
+            # Другие воркеры увидят выдачу сразу, не дожидаясь её записи в search_results
+            await loop.run_in_executor(None, shared_cache.put, "serp", self._shared_key(key), result, self.ttl)
+        return result, False
+
+    async def get(self, key: tuple, fetch, database=None):
+        """Возвращает выдачу и признак того, что она взята из кэша.
+
+        fetch — корутинная функция без аргументов, запрашивающая поисковый API.
+        """
+        result = self._get_local(key)
+        if result is not None:
+            self.hits += 1
+            return dict(result), True
+        task = self._in_flight.get(key)
+        if task is not None:
+            # Такой же запрос уже выполняется: ждём его результат вместо повторного обращения к API
+            self.coalesced += 1
+            logger.info(f"SERP request coalesced: {key}")
+            result, _ = await asyncio.shield(task)
+            return (dict(result) if result else result), True
+        task = asyncio.create_task(self._load(key, fetch, database))
+        self._in_flight[key] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        result, from_cache = await asyncio.shield(task)
+        return (dict(result) if result else result), from_cache
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+serp_cache = SerpCache(SERP_CACHE_TTL, SERP_CACHE_MAX_ENTRIES)
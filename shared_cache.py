@@ -0,0 +1,117 @@
+import pickle
+import sqlite3
+import threading
+import time
+
+from config import SHARED_CACHE_ENABLED, SHARED_CACHE_PATH, SHARED_CACHE_MAX_ENTRIES
+from logger import logger
+
+
+class SharedCache:
+    """Кэш в файле SQLite, общий для всех процессов-воркеров на одной машине.
+
+    Записи разделены по пространствам имён (выдача, страницы) и живут до expires_at.
+    Значения сериализуются pickle: файл пишет и читает только само приложение.
+    """
+
+    def __init__(self, path: str, max_entries: int, enabled: bool):
+        self.path = path
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=15, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_shared_cache_expires_at ON shared_cache (expires_at)")
+            self._conn.commit()
+        return self._conn
+
+    def warm_up(self):
+        if self.enabled:
+            with self._lock:
+                self._connect()
+
+    def get_many(self, namespace: str, keys: list) -> dict:
+        """Возвращает неистёкшие значения по ключам пространства имён."""
+        if not self.enabled or not keys:
+            return {}
+        unique_keys = list(set(keys))
+        found = {}
+        try:
+            with self._lock:
+                conn = self._connect()
+                now = time.time()
+                for i in range(0, len(unique_keys), 500):
+                    chunk = unique_keys[i:i + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = conn.execute(
+                        f"SELECT key, value FROM shared_cache WHERE namespace = ? AND key IN ({placeholders}) "
+                        f"AND expires_at > ?", [namespace, *chunk, now]
+                    ).fetchall()
+                    found.update({key: pickle.loads(value) for key, value in rows})
+        except (sqlite3.Error, pickle.UnpicklingError) as e:
+            logger.error(f"Error reading shared cache: {e}")
+            found = {}
+        self.hits += len(found)
+        self.misses += len(unique_keys) - len(found)
+        return found
+
+    def get(self, namespace: str, key: str):
+        return self.get_many(namespace, [key]).get(key)
+
+    def put_many(self, namespace: str, items: dict, ttl: float):
+        """Сохраняет значения на ttl секунд; при переполнении удаляет истёкшие и самые старые записи."""
+        if not self.enabled or not items:
+            return
+        try:
+            with self._lock:
+                conn = self._connect()
+                expires_at = time.time() + ttl
+                conn.executemany(
+                    "INSERT OR REPLACE INTO shared_cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    [(namespace, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), expires_at)
+                     for key, value in items.items()]
+                )
+                self._writes += 1
+                # Размер проверяется не на каждой записи: COUNT по всему файлу заметно дороже вставки
+                if self._writes % 100 == 0:
+                    self._evict(conn)
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error writing shared cache: {e}")
+
+    def put(self, namespace: str, key: str, value, ttl: float):
+        self.put_many(namespace, {key: value}, ttl)
+
+    def _evict(self, conn):
+        conn.execute("DELETE FROM shared_cache WHERE expires_at <= ?", (time.time(),))
+        overflow = conn.execute("SELECT COUNT(*) FROM shared_cache").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM shared_cache WHERE rowid IN "
+                "(SELECT rowid FROM shared_cache ORDER BY expires_at LIMIT ?)", (overflow,)
+            )
+            logger.info(f"Shared cache evicted {overflow} entries")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+shared_cache = SharedCache(SHARED_CACHE_PATH, SHARED_CACHE_MAX_ENTRIES, SHARED_CACHE_ENABLED)
@@ -0,0 +1,96 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+
+def build_term_matrix(documents: list):
+    """Строит словарь лемм и матрицу частот документы × леммы.
+
+    Словарь упорядочен по первому появлению леммы, как столбцы DataFrame из списка Counter.
+    """
+    vocabulary = {}
+    doc_ids = []
+    term_ids = []
+    for doc_id, lemmas in enumerate(documents):
+        term_ids.extend(vocabulary.setdefault(lemma, len(vocabulary)) for lemma in lemmas)
+        doc_ids.extend([doc_id] * len(lemmas))
+    n_docs, n_terms = len(documents), len(vocabulary)
+    flat = np.asarray(doc_ids, dtype=np.int64) * n_terms + np.asarray(term_ids, dtype=np.int64)
+    matrix = np.bincount(flat, minlength=n_docs * n_terms).astype(np.int32).reshape(n_docs, n_terms)
+    return np.array(list(vocabulary), dtype=object), matrix
+
+
+def column_median(matrix):
+    # Медиана по документам; если документов нет, частоты считаются нулевыми
+    if matrix.shape[0] == 0:
+        return np.zeros(matrix.shape[1])
+    return np.median(matrix, axis=0)
+
+
+def median_frequencies(documents: list) -> pd.Series:
+    """Медиана частоты каждой леммы по документам, отсортированная по убыванию."""
+    vocabulary, matrix = build_term_matrix(documents)
+    return pd.Series(column_median(matrix), index=vocabulary).sort_values(ascending=False)
+
+
+def median_profile(term_counts: list):
+    """Медианы частот лемм по документам, заданным словарями лемма -> частота.
+
+    Возвращает леммы в лексикографическом порядке и округлённые вверх медианы.
+    """
+    vocabulary = {}
+    doc_ids = []
+    term_ids = []
+    values = []
+    for doc_id, counts in enumerate(term_counts):
+        term_ids.extend(vocabulary.setdefault(term, len(vocabulary)) for term in counts)
+        doc_ids.extend([doc_id] * len(counts))
+        values.extend(counts.values())
+    matrix = np.zeros((len(term_counts), len(vocabulary)), dtype=np.int32)
+    matrix[np.asarray(doc_ids, dtype=np.int64), np.asarray(term_ids, dtype=np.int64)] = values
+    return sorted_medians(np.array(list(vocabulary), dtype=object), matrix)
+
+
+def sorted_medians(terms, matrix):
+    """Медианы столбцов матрицы документы × леммы в лексикографическом порядке лемм, округлённые вверх."""
+    order = np.argsort(terms, kind="stable")
+    return terms[order], np.ceil(column_median(matrix[:, order])).astype(np.int64)
+
+
+def compare_with_profile(main_lemmas: list, terms, medians):
+    """Сравнивает частоты лемм основной страницы с готовыми медианами конкурентов из median_profile."""
+    main_counts = Counter(main_lemmas)
+    median_by_term = dict(zip(terms.tolist(), medians.tolist()))
+    # Порядок слов как у индекса после внешнего объединения: лексикографический
+    vocabulary = np.array(sorted(median_by_term.keys() | main_counts.keys()), dtype=object)
+    main_freq = np.fromiter((main_counts.get(term, 0) for term in vocabulary), dtype=np.int64, count=len(vocabulary))
+    median_freq = np.fromiter((median_by_term.get(term, 0) for term in vocabulary), dtype=np.int64,
+                              count=len(vocabulary))
+    diff = median_freq - main_freq
+
+    lsi_mask = (main_freq == 0) & (median_freq > 0)
+    increase_mask = (main_freq > 0) & (diff > 0)
+    decrease_mask = (main_freq > 0) & (diff <= -10)
+
+    lsi = pd.Series(median_freq[lsi_mask], index=vocabulary[lsi_mask]).sort_values(ascending=False)
+    increase_qty = pd.Series(diff[increase_mask], index=vocabulary[increase_mask]).sort_values(ascending=False)
+    decrease_qty = pd.Series(diff[decrease_mask], index=vocabulary[decrease_mask]).sort_values(ascending=True)
+
+    if len(lsi) < 20:
+        need_to_add = 20 - len(lsi)
+        lsi = pd.concat([lsi, increase_qty[:need_to_add]])
+        # Слова, добавленные в LSI, уменьшают рекомендованное увеличение на единицу
+        increase_qty = increase_qty - increase_qty.index.isin(lsi.index)
+        increase_qty = increase_qty.mask(increase_qty <= 0).dropna()
+
+    return lsi, increase_qty, decrease_qty
+
+
+def compare_frequencies(main_lemmas: list, competitor_lemmas: list):
+    """Сравнивает частоты лемм основной страницы с медианой по конкурентам.
+
+    Возвращает LSI-слова, слова, частоту которых нужно увеличить, и слова, частоту которых нужно уменьшить.
+    """
+    terms, medians = median_profile([Counter(lemmas) for lemmas in competitor_lemmas])
+    return compare_with_profile(main_lemmas, terms, medians)
@@ -0,0 +1,80 @@
+"""Совпадение расчёта частот на NumPy с прежним расчётом через Counter → DataFrame."""
+import os
+import random
+import sys
+from collections import Counter
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from bench_frequency import legacy_compare_frequencies, legacy_median_frequency, make_documents, as_items  # noqa: E402
+from term_frequency import compare_frequencies, compare_with_profile, median_frequencies, median_profile  # noqa: E402
+
+
+def assert_same(expected, actual):
+    for name, left, right in zip(("lsi", "increase", "decrease"), expected, actual):
+        assert as_items(left) == as_items(right), name
+
+
+def random_documents(seed):
+    # Выдачи разного размера, включая пустые страницы и очень маленький словарь
+    rng = random.Random(seed)
+    return make_documents(rng.randint(1, 31), rng.randint(5, 500), rng.randint(0, 300), seed)
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_compare_frequencies_matches_pandas(seed):
+    documents = random_documents(seed)
+    assert_same(legacy_compare_frequencies(documents[0], documents[1:]),
+                compare_frequencies(documents[0], documents[1:]))
+
+
+@pytest.mark.parametrize("documents", [
+    [[]],
+    [["слово"], []],
+    [[], ["слово", "слово", "текст"]],
+    [["слово"] * 30, ["слово"] * 5, ["слово"] * 7, ["текст"]],
+])
+def test_compare_frequencies_edge_cases(documents):
+    assert_same(legacy_compare_frequencies(documents[0], documents[1:]),
+                compare_frequencies(documents[0], documents[1:]))
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_median_frequencies_matches_pandas(seed):
+    documents = random_documents(seed)
+    assert legacy_median_frequency(documents).to_dict() == median_frequencies(documents).to_dict()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_profile_path_matches_pandas(seed):
+    # Профиль конкурентов хранит частоты страниц словарями и может перечислять страницы в любом порядке
+    documents = random_documents(seed)
+    term_counts = [dict(Counter(lemmas)) for lemmas in documents[1:]]
+    random.Random(seed).shuffle(term_counts)
+    terms, medians = median_profile(term_counts)
+    assert_same(legacy_compare_frequencies(documents[0], documents[1:]),
+                compare_with_profile(documents[0], terms, medians))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_compact_profile_matches_pandas(seed):
+    # Профиль хранит частоты массивами и лишние страницы, которых нет в текущей выдаче
+    from competitor_profile import CompetitorProfile
+    documents = random_documents(seed)
+    extra = make_documents(3, 50, 40, seed + 1000)
+    page_counts = {f"https://site{i}.ru/": (str(i), dict(Counter(lemmas)))
+                   for i, lemmas in enumerate(documents[1:] + extra)}
+    profile = CompetitorProfile.from_counts("key", page_counts, {}, "v", datetime.now())
+    restored = CompetitorProfile.from_row(SimpleNamespace(**profile.to_row("запрос", "213", "")))
+    urls = [f"https://site{i}.ru/" for i in range(len(documents) - 1)]
+    for current in (profile, restored):
+        assert current.page_counts(urls[0], "0") == page_counts[urls[0]][1]
+        terms, medians = current.medians(urls)
+        assert_same(legacy_compare_frequencies(documents[0], documents[1:]),
+                    compare_with_profile(documents[0], terms, medians))
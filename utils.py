@@ -1,81 +1,183 @@
 import asyncio
-import re
 import ssl
 from collections import Counter
+from datetime import datetime
 from xml.etree import ElementTree as ET
 
 import aiohttp
-import pandas as pd
-import tldextract
-from bs4 import BeautifulSoup
-from fake_useragent import UserAgent
-from joblib import Parallel, delayed
-from numpy import ceil
-from pymystem3 import Mystem
-
-from config import xml_user, xml_key, google_api_key, russian_stop_words
-from logger import logger
-
-mystem = Mystem()
-
 
-async def process_search_results(background_tasks, database, db_request, search_results, url):
-    # Планируем сохранение результатов поиска в фоне
-    background_tasks.add_task(database.save_search_results, db_request.id, search_results)
-    # Загружаем стоп-слова из файла
-    stop_words = load_stop_words("stop_words.txt")
-    # Фильтруем URL-адреса по стоп-словам
-    filtered_urls = filter_urls(list(search_results.values()), stop_words)[:30]
-    filtered_urls = set(filtered_urls)
-    filtered_urls = {i: page_url for i, page_url in search_results.items() if page_url in filtered_urls}
-    filtered_urls[0] = url
+from config import (xml_user, xml_key, google_api_key, PAGE_FETCH_TIMEOUT, PAGE_CACHE_TTL, YANDEX_XML_URL,
+                    GOOGLE_SERP_URL, GOOGLE_XML_URL, GOOGLE_GEOTARGETS_URL, REQUEST_MAX_PAGE_BYTES, LEMMA_MAX_TOKENS)
+from competitor_profile import competitor_profiles, make_profile_key, CompetitorProfile
+from db_utils import build_request_artifacts
+from fetch_scheduler import fetch_scheduler
+from filters import url_filter, lemma_stop_words
+from html_extract import (read_limited, extract_text_async, is_html_response, request_budget, ByteBudget,
+                          TRUNCATED_BUDGET)
+from http_client import http_client, user_agents
+from lemma_cache import lemma_cache
+from logger import logger
+from metrics import stage, PAGE_FETCHES
+from mystem_pool import mystem_pool, mystem_lemmatize
+from page_cache import page_cache
+from page_store import content_hash, StoredCachedPage
+from shared_cache import shared_cache
+from term_frequency import compare_with_profile, median_frequencies
+from write_queue import persist_request_artifacts
+
+# Страницы конкурентов загружаются без проверки сертификатов
+ssl_context = ssl.create_default_context()
+ssl_context.check_hostname = False
+ssl_context.verify_mode = ssl.CERT_NONE
+page_fetch_timeout = aiohttp.ClientTimeout(total=PAGE_FETCH_TIMEOUT)
+# Тексты, которые сейчас лемматизируются: ключ кэша лемм -> задача с леммами этих текстов
+lemmas_in_flight = {}
+
+
+class SharedFetches:
+    """Загрузки страниц, общие для анализов одного пакета: URL -> задача загрузки.
+
+    Задача хранится, пока её ждёт хоть один анализ: дальше текст страницы нужен только
+    результатам этих анализов, а следующие элементы пакета найдут страницу в кэше.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._waiters = Counter()
+        self.started = 0
+
+    def acquire(self, url: str, start):
+        task = self._tasks.get(url)
+        if task is None:
+            task = asyncio.create_task(start())
+            self._tasks[url] = task
+            self.started += 1
+        self._waiters[url] += 1
+        return task
+
+    def release(self, url: str):
+        self._waiters[url] -= 1
+        if self._waiters[url] <= 0:
+            del self._waiters[url]
+            self._tasks.pop(url, None)
+
+
+async def process_search_results(background_tasks, database, db_request, search_results, url, serp_cached=False,
+                                 shared_fetches: SharedFetches = None):
+    with stage("filter"):
+        # Исключаем сайты, хосты которых содержат стоп-слова; фильтр загружен один раз и следит за файлом
+        filtered_urls = url_filter.filter(list(search_results.values()))[:30]
+        filtered_urls = set(filtered_urls)
+        filtered_urls = {i: page_url for i, page_url in search_results.items() if page_url in filtered_urls}
+        filtered_urls[0] = url
     logger.info('Urls are filtered')
-    # Асинхронно обрабатываем все URL-адреса и сохраняем их текстовое содержимое в базе данных
-    contents = await process_urls(filtered_urls)
+    competitor_urls = {page_url for page_url in filtered_urls.values() if page_url != url}
+    # Частоты лемм конкурентов не зависят от анализируемой страницы: берём их из профиля запроса
+    profile_key = make_profile_key(db_request.search_string, db_request.region, db_request.domain)
+    profile = await competitor_profiles.get(profile_key, database)
+    profile_hit = profile is not None and profile.covers(competitor_urls, lemmas_version(),
+                                                         competitor_profiles.ttl, competitor_profiles.retry_ttl)
+    # При готовом профиле загружаем только анализируемую страницу
+    to_fetch = {0: url} if profile_hit else filtered_urls
+    # Берём из кэша ранее загруженные страницы, свежие не скачиваем заново
+    cached_pages = await load_cached_pages(database, list(to_fetch.values()))
+    cache_updates = {}
+    # Асинхронно обрабатываем все URL-адреса и сохраняем их текстовое содержимое в базе данных;
+    # суммарный объём читаемых тел страниц ограничен бюджетом анализа
+    budget = ByteBudget(REQUEST_MAX_PAGE_BYTES)
+    budget_token = request_budget.set(budget)
+    try:
+        with stage("fetch"):
+            contents = await process_urls(to_fetch, cached_pages, cache_updates, shared_fetches)
+    finally:
+        request_budget.reset(budget_token)
+    logger.info(f"Page bodies read: {budget.used} of {budget.limit} bytes")
     logger.info('Urls are processed')
-    # Планируем сохранение результатов поиска в фоне
-    background_tasks.add_task(database.save_page_contents, db_request.id, contents)
+    if cache_updates and shared_cache.enabled:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, shared_cache.put_many, "page", cache_updates, PAGE_CACHE_TTL)
     main_content = contents.get(url)
-    other_contents = [content for page_url, content in contents.items() if page_url != url]
-    # Получаем медиану частоты встречаемости лемматизированных слов
-    median_frequency = await get_median_lemmatized_word_frequency(other_contents)
-    main_frequency = await get_median_lemmatized_word_frequency([main_content])
+    profile_row = None
+    if profile_hit:
+        with stage("lemmatize"):
+            main_lemmas = (await get_lemmatized_words([main_content]))[0]
+        competitor_profiles.record(hit=True)
+    else:
+        with stage("lemmatize"):
+            main_lemmas, profile = await update_competitor_profile(profile_key, profile, main_content,
+                                                                   competitor_urls, contents)
+        loop = asyncio.get_running_loop()
+        profile_row = await loop.run_in_executor(None, profile.to_row, db_request.search_string,
+                                                 db_request.region, db_request.domain)
+    # Сравниваем частоты лемм основной страницы с медианой по конкурентам
+    with stage("frequency"):
+        terms, medians = profile.medians(competitor_urls)
+        lsi, increase_qty, decrease_qty = compare_with_profile(main_lemmas, terms, medians)
     logger.info('Frequencies of lemmas are calculated')
-    # Добавляем имена к сериям
-    main_frequency.name = 'main_freq'
-    median_frequency.name = 'median_freq'
-    # Объединяем два DataFrame по индексу
-    merged_df = pd.merge(main_frequency, median_frequency, left_index=True, right_index=True, how='outer')
-    logger.info('main frequency and median frequency are merged')
-    # Заменяем NaN на 0
-    merged_df.fillna(0, inplace=True)
-    # Вычисляем разность между столбцами
-    merged_df['diff'] = merged_df['median_freq'] - merged_df['main_freq']
-    merged_df = merged_df.apply(ceil).astype(int)
-    lsi = merged_df[(merged_df['main_freq'] == 0) & (merged_df['median_freq'] > 0)]['median_freq']
-    lsi = lsi.sort_values(ascending=False)
-    increase_qty = merged_df[(merged_df['main_freq'] > 0) & (merged_df['diff'] > 0)]['diff']
-    increase_qty = increase_qty.sort_values(ascending=False)
-    decrease_qty = merged_df[(merged_df['main_freq'] > 0) & (merged_df['diff'] <= -10)]['diff']
-    decrease_qty = decrease_qty.sort_values(ascending=True)
-
-    if len(lsi) < 20:
-        need_to_add = 20 - len(lsi)
-        lsi = pd.concat([lsi, increase_qty[:need_to_add]])
-        lsi_dict = {index: 1 for index in lsi.index}
-        for index in increase_qty.index:
-            increase_qty[index] -= lsi_dict.get(index, 0)
-        increase_qty = increase_qty.mask(increase_qty <= 0).dropna()
-
-    # Сохранение результатов в базу данных
-    background_tasks.add_task(database.save_decrease_frequency, db_request.id, decrease_qty.to_dict())
-    background_tasks.add_task(database.save_increase_frequency, db_request.id, increase_qty.to_dict())
-    background_tasks.add_task(database.save_lsi, db_request.id, list(lsi.keys()))
+
+    # Тексты конкурентов из профиля уже сохранены, в запрос записываются только ссылки на них
+    stored_pages = {page_url: profile.pages[page_url][0] for page_url in competitor_urls
+                    if profile_hit and page_url in profile.pages}
+    # Сохранение всех результатов запроса в базу данных одной транзакцией в фоне
+    artifacts = build_request_artifacts(db_request, search_results, serp_cached, contents,
+                                        list(cache_updates.values()), decrease_qty.to_dict(),
+                                        increase_qty.to_dict(), list(lsi.keys()), stored_pages, profile_row)
+    background_tasks.add_task(persist_request_artifacts, database, artifacts)
 
     logger.info('Обработка запроса завершена успешно')
     return decrease_qty, filtered_urls, increase_qty, lsi
 
 
+async def update_competitor_profile(key: str, profile, main_content, competitor_urls: set, contents: dict):
+    """Строит профиль конкурентов заново, лемматизируя только новые и изменившиеся страницы.
+
+    Возвращает леммы анализируемой страницы и новый профиль.
+    """
+    loop = asyncio.get_running_loop()
+    pages = {page_url: content for page_url, content in contents.items() if page_url in competitor_urls}
+    digests = await loop.run_in_executor(None, lambda: {page_url: content_hash(content)
+                                                        for page_url, content in pages.items()})
+    version = lemmas_version()
+    if profile is not None and profile.lemmas_version != version:
+        profile = None
+    counts = {}
+    changed = []
+    for page_url, digest in digests.items():
+        page_counts = profile.page_counts(page_url, digest) if profile is not None else None
+        if page_counts is None:
+            changed.append(page_url)
+        else:
+            counts[page_url] = page_counts
+    lemmatized = await get_lemmatized_words([main_content] + [pages[page_url] for page_url in changed])
+    for page_url, lemmas in zip(changed, lemmatized[1:]):
+        counts[page_url] = dict(Counter(lemmas))
+    now = datetime.now()
+    # Не загрузившиеся страницы запоминаем отдельно: профиль подходит без них только недолго
+    failed = {page_url: now for page_url in competitor_urls if page_url not in digests}
+    profile = CompetitorProfile.from_counts(key, {page_url: (digests[page_url], counts[page_url])
+                                                  for page_url in digests}, failed, version, now)
+    competitor_profiles.put(profile)
+    competitor_profiles.record(hit=False, reused=len(digests) - len(changed), counted=len(changed))
+    return lemmatized[0], profile
+
+
+async def load_cached_pages(database, urls: list) -> dict:
+    """Возвращает сохранённые страницы по URL из БД и общего для воркеров кэша.
+
+    В общий кэш страница попадает сразу после загрузки, а в БД — только при сохранении
+    результатов запроса, поэтому при расхождении берётся более свежая запись.
+    """
+    cached_pages = await database.get_cached_pages(urls)
+    if shared_cache.enabled:
+        loop = asyncio.get_running_loop()
+        shared = await loop.run_in_executor(None, shared_cache.get_many, "page", urls)
+        for url, entry in shared.items():
+            current = cached_pages.get(url)
+            if current is None or current.fetched_at < entry['fetched_at']:
+                cached_pages[url] = StoredCachedPage.from_entry(entry)
+    return cached_pages
+
+
 async def parse_xml(xml_string):
     root = ET.fromstring(xml_string)
     urls = []
@@ -86,7 +188,7 @@ async def parse_xml(xml_string):
 
 
 async def yandex_xmlproxy_request(search_string: str, region: str, user_id: str = xml_user, api_key: str = xml_key):
-    url = 'https://xmlstock.com/yandex/xml/'
+    url = YANDEX_XML_URL
 
     params = {
         'user': user_id,
@@ -96,25 +198,25 @@ async def yandex_xmlproxy_request(search_string: str, region: str, user_id: str
         'groupby': 'mode=flat.groups-on-page=100.docs-in-group=1'
     }
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url, params=params) as response:
-                if response.status != 200:
-                    logger.error(f"Yandex XMLProxy request error: HTTP status code {response.status}")
-                    return None
+    session = http_client.session
+    try:
+        async with session.get(url, params=params) as response:
+            if response.status != 200:
+                logger.error(f"Yandex XMLProxy request error: HTTP status code {response.status}")
+                return None
 
-                content = await response.text()
-                result = await parse_xml(content)
-                result = dict(enumerate(result, start=1))
-                logger.info(f"Yandex XMLProxy request successful. Responce: {result}")
-                return result
-        except aiohttp.ClientError as e:
-            logger.error(f"Yandex XMLProxy request error: {e}")
-            return None
+            content = await response.text()
+            result = await parse_xml(content)
+            result = dict(enumerate(result, start=1))
+            logger.info(f"Yandex XMLProxy request successful. Responce: {result}")
+            return result
+    except aiohttp.ClientError as e:
+        logger.error(f"Yandex XMLProxy request error: {e}")
+        return None
 
 
 async def google_proxy_request(search_string: str, location: str, domain: str):
-    url = 'https://api.spaceserp.com/google/search'
+    url = GOOGLE_SERP_URL
 
     params = {
         'apiKey': google_api_key,
@@ -128,143 +230,227 @@ async def google_proxy_request(search_string: str, location: str, domain: str):
         'device': 'desktop'
     }
 
-    async with aiohttp.ClientSession() as session:
+    session = http_client.session
+    try:
+        async with session.get(url, params=params) as response:
+            if response.status != 200:
+                logger.error(f"Google SERP API request error: HTTP status code {response.status}")
+                return None
+
+            content = await response.json()
+            result = dict(enumerate([result.get('link') for result in content.get('organic_results')], start=1))
+            logger.info(f"Google SERP API request successful. Responce: {result}")
+            return result
+    except aiohttp.ClientError as e:
+        logger.error(f"Google SERP API request error: {e}")
+        # tldextract и его список публичных суффиксов нужны только запасному провайдеру
+        import pandas as pd
+        import tldextract
+
+        url = GOOGLE_XML_URL
+        lr = pd.read_csv(GOOGLE_GEOTARGETS_URL)
+        lr_value = int(lr[lr['Canonical Name'] == location]['Criteria ID'].values[0])
+        params = {
+            'user': xml_user,
+            'key': xml_key,
+            'query': search_string,
+            'lr': lr_value,
+            'domain': tldextract.extract(domain).suffix,
+            'hl': 'ru',
+            'groupby': 100,
+            'device': 'desktop'
+        }
+
         try:
             async with session.get(url, params=params) as response:
                 if response.status != 200:
-                    logger.error(f"Google SERP API request error: HTTP status code {response.status}")
+                    logger.error(f"Google XMLProxy request error: HTTP status code {response.status}")
                     return None
 
                 content = await response.json()
-                result = dict(enumerate([result.get('link') for result in content.get('organic_results')], start=1))
-                logger.info(f"Google SERP API request successful. Responce: {result}")
+                result = dict(enumerate([result.get('url') for result in content.get('results').values()], start=1))
+                logger.info(f"Google XMLProxy request successful. Response: {result}")
                 return result
         except aiohttp.ClientError as e:
-            logger.error(f"Google SERP API request error: {e}")
-            url = 'https://xmlstock.com/google/json/'
-            lr = pd.read_csv('https://xmlstock.com/geotargets-google.csv')
-            lr_value = int(lr[lr['Canonical Name'] == location]['Criteria ID'].values[0])
-            params = {
-                'user': xml_user,
-                'key': xml_key,
-                'query': search_string,
-                'lr': lr_value,
-                'domain': tldextract.extract(domain).suffix,
-                'hl': 'ru',
-                'groupby': 100,
-                'device': 'desktop'
-            }
-
-            try:
-                async with session.get(url, params=params) as response:
-                    if response.status != 200:
-                        logger.error(f"Google XMLProxy request error: HTTP status code {response.status}")
-                        return None
-
-                    content = await response.json()
-                    result = dict(enumerate([result.get('url') for result in content.get('results').values()], start=1))
-                    logger.info(f"Google XMLProxy request successful. Response: {result}")
-                    return result
-            except aiohttp.ClientError as e:
-                logger.error(f"Google XMLProxy request error: {e}")
-                return None
-
-
-def load_stop_words(file_path: str) -> set:
-    """Загружает стоп-слова из указанного файла."""
-    stop_words = set()
-    with open(file_path, "r", encoding="utf-8") as f:
-        for line in f:
-            stop_words.add(line.strip())
-    return stop_words
-
+            logger.error(f"Google XMLProxy request error: {e}")
+            return None
 
-def filter_urls(urls: list, stop_words: set) -> list:
-    """Фильтрует URL-адреса по стоп-словам."""
-    filtered_urls = []
-    for url in urls:
-        if not any(stop_word in url for stop_word in stop_words):
-            filtered_urls.append(url)
-    return filtered_urls
 
+async def process_urls(urls: dict, cached_pages: dict = None, cache_updates: dict = None,
+                       shared_fetches: SharedFetches = None):
+    """Загружает страницы по URL.
 
-async def process_urls(urls: dict):
+    shared_fetches — загрузки, общие для нескольких вызовов: страница, которую уже
+    загружает другой анализ пакета, скачивается один раз.
+    """
     page_contents = {}
-    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-        tasks = []
-        for num_of_url, url in urls.items():
-            task = asyncio.create_task(fetch_page_content(session, url, num_of_url))
-            tasks.append(task)
-        results = await asyncio.gather(*tasks)
-        for url, content in results:
-            if content:
-                page_contents[url] = content
+    cached_pages = cached_pages or {}
+    session = http_client.session
+    to_fetch = {}
+    main_url = urls.get(0)
+    for num_of_url, url in urls.items():
+        # Анализируемая страница может оказаться и в выдаче: загружаем её один раз, как анализируемую
+        if num_of_url != 0 and url == main_url:
+            continue
+        cached = cached_pages.get(url)
+        # Страницы конкурентов в пределах срока свежести отдаём из кэша;
+        # анализируемую страницу всегда перепроверяем, её могли только что изменить
+        if num_of_url != 0 and page_cache.is_fresh(cached):
+            page_cache.hits += 1
+            page_contents[url] = cached.content
+            continue
+        to_fetch[num_of_url] = url
+
+    acquired = []
+
+    def fetch(num_of_url, url, attempt):
+        cached = cached_pages.get(url)
+        if shared_fetches is None or attempt > 0:
+            return fetch_page_content(session, url, num_of_url, cached, cache_updates)
+        task = shared_fetches.acquire(url, lambda: fetch_page_content(session, url, num_of_url, cached,
+                                                                      cache_updates))
+        acquired.append(url)
+        # Отмена одного анализа не должна прерывать загрузку, которую ждут другие
+        return asyncio.shield(task)
+
+    # Не ждём все страницы: планировщик завершает загрузку по кворуму конкурентов или по сроку
+    try:
+        fetched = await fetch_scheduler.run(to_fetch, fetch, available=len(page_contents))
+    finally:
+        for url in acquired:
+            shared_fetches.release(url)
+    for url in to_fetch.values():
+        if fetched.get(url):
+            page_contents[url] = fetched[url]
     return page_contents
 
 
-async def fetch_page_content(session, url: str, num_of_url: int):
+async def fetch_page_content(session, url: str, num_of_url: int, cached=None, cache_updates: dict = None):
     logger.info(f"Обрабатываем {num_of_url if num_of_url != 0 else 'оригинальную'} страницу {url}...")
-    try:
-        ua = UserAgent()
-        headers = {
-            'User-Agent': ua.random
-        }
-
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-
-        async with session.get(url, ssl=ssl_context, headers=headers) as response:
-            if response.status == 200:
-                content = await response.text()
-                soup = BeautifulSoup(content, "html.parser")
-                for script_or_style in soup(["script", "style"]):
-                    script_or_style.decompose()
-                page_content = soup.get_text(separator=" ").strip()
-                page_content = re.sub(r"\s+", " ", page_content)
-                page_content = page_content.encode("utf-8", errors="replace").decode("utf-8", errors="replace")
-                logger.info(f"Обработка страницы {url} завершена успешно")
-                return (url, page_content)
-            else:
-                logger.warning(f"HTTP status code {response.status} for URL {url}")
-                return (url, None)
-    except asyncio.TimeoutError:
-        logger.error(f"Timeout error fetching URL {url}")
-        with open("timeout_urls.txt", "a") as f:
-            f.write(url + "\n")
-        return (url, None)
-    except Exception as e:
-        logger.error(f"Error fetching URL {url}: {e}")
-        return (url, None)
+    with stage("page_fetch"):
+        try:
+            headers = {
+                'User-Agent': user_agents.random()
+            }
+            headers.update(page_cache.conditional_headers(cached))
+
+            async with session.get(url, ssl=ssl_context, headers=headers, timeout=page_fetch_timeout) as response:
+                if response.status == 304 and cached is not None:
+                    # Страница не изменилась: берём текст из кэша и продлеваем срок свежести
+                    page_cache.revalidated += 1
+                    if cache_updates is not None:
+                        entry = page_cache.make_entry(url, cached.content, response.headers)
+                        entry['etag'] = entry['etag'] or cached.etag
+                        entry['last_modified'] = entry['last_modified'] or cached.last_modified
+                        cache_updates[url] = entry
+                    PAGE_FETCHES.labels("not_modified").inc()
+                    logger.info(f"Страница {url} не изменилась, используем кэш")
+                    return (url, cached.content)
+                elif response.status == 200:
+                    page_cache.misses += 1
+                    # Не HTML (PDF, архивы, изображения) и страницы сверх бюджета анализа не скачиваем
+                    if not is_html_response(response):
+                        PAGE_FETCHES.labels("skipped_type").inc()
+                        logger.info(f"Skipping {url}: Content-Type {response.content_type}")
+                        return (url, None)
+                    # Анализируемая страница загружается всегда, бюджет расходуют только страницы конкурентов
+                    budget = request_budget.get() if num_of_url != 0 else None
+                    if budget is not None and budget.remaining == 0:
+                        PAGE_FETCHES.labels("over_budget").inc()
+                        logger.warning(f"Skipping {url}: page bytes budget of the request is exhausted")
+                        return (url, None)
+                    # Читаем тело частями с ограничением размера, разбираем HTML вне цикла событий
+                    chunks, truncated = await read_limited(response, budget=budget)
+                    if truncated == TRUNCATED_BUDGET:
+                        # Начало страницы не заменяет её целиком: такой текст не кэшируем и не учитываем,
+                        # в профиле конкурентов страница остаётся незагрузившейся
+                        PAGE_FETCHES.labels("over_budget").inc()
+                        logger.warning(f"Skipping {url}: page bytes budget of the request ran out while reading")
+                        return (url, None)
+                    with stage("extract"):
+                        page_content = await extract_text_async(chunks, response.charset)
+                    if cache_updates is not None and page_content:
+                        cache_updates[url] = page_cache.make_entry(url, page_content, response.headers)
+                    PAGE_FETCHES.labels("ok").inc()
+                    logger.info(f"Обработка страницы {url} завершена успешно")
+                    return (url, page_content)
+                else:
+                    PAGE_FETCHES.labels("http_error").inc()
+                    logger.warning(f"HTTP status code {response.status} for URL {url}")
+                    return (url, None)
+        except asyncio.TimeoutError:
+            PAGE_FETCHES.labels("timeout").inc()
+            logger.error(f"Timeout error fetching URL {url}")
+            with open("timeout_urls.txt", "a") as f:
+                f.write(url + "\n")
+            return (url, None)
+        except Exception as e:
+            PAGE_FETCHES.labels("error").inc()
+            logger.error(f"Error fetching URL {url}: {e}")
+            return (url, None)
+
+
+def lemmas_version() -> str:
+    # Частоты лемм, посчитанные с другими стоп-словами или ограничением длины документа, не сравнимы
+    return f"{lemma_stop_words.version}:{LEMMA_MAX_TOKENS}"
+
+
+def remove_stop_words(lemmas):
+    return lemma_stop_words.remove(lemmas)
 
 
 def lemmatize_text(text):
-    # Удаление лишнего
-    text = re.sub(r"[^а-яА-ЯёЁa-zA-Z]+", " ", text)
-    # Удаление цифр
-    text = re.sub(r'\d+', '', text)
+    # Получаем леммы для каждого токена в тексте, исключая стоп-слова
+    return remove_stop_words(mystem_lemmatize(text))
 
-    lemmas = mystem.lemmatize(text.lower())
 
-    # Получаем леммы для каждого токена в тексте, исключая стоп-слова
-    lemmas = [lemma for lemma in lemmas if lemma not in russian_stop_words and lemma.strip() and len(lemma) > 2]
-    return lemmas
+async def lemmatize_missing(missing: dict) -> dict:
+    """Лемматизирует новые тексты в пуле Mystem и сохраняет леммы в кэш; возвращает ключ кэша -> леммы."""
+    lemmatized = await mystem_pool.lemmatize_many(list(missing.values()))
+    fresh = dict(zip(missing.keys(), lemmatized))
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, lemma_cache.put_many, fresh)
+    return fresh
 
 
-def get_lemmatized_words(contents):
-    # Использование Parallel и delayed из joblib для параллельной обработки
-    lemmatized_words = Parallel(n_jobs=-1)(delayed(lemmatize_text)(content) for content in contents)
-    return lemmatized_words
+def _release_in_flight(task, keys):
+    for key in keys:
+        if lemmas_in_flight.get(key) is task:
+            del lemmas_in_flight[key]
+    # Ошибку получают ожидающие запросы; если их не осталось, не выводим предупреждение
+    if not task.cancelled():
+        task.exception()
 
 
-async def get_median_lemmatized_word_frequency(contents):
-    # Синхронный вызов асинхронной функции
+async def get_lemmatized_words(contents):
+    # Леммы уже встречавшихся страниц берём из кэша, Mystem запускаем только для новых текстов
     loop = asyncio.get_running_loop()
-    results = await loop.run_in_executor(None, get_lemmatized_words, contents)
-
-    word_frequencies_list = [Counter(result) for result in results]
-    df = pd.DataFrame(word_frequencies_list)
-    df = df.fillna(0)
-    median_frequencies = df.median()
-    median_frequencies = median_frequencies.sort_values(ascending=False)
-    return median_frequencies
+    keys = [lemma_cache.make_key(content) for content in contents]
+    cached = await loop.run_in_executor(None, lemma_cache.get_many, keys)
+    missing = {}
+    waiting = {}
+    for key, content in zip(keys, contents):
+        if key in cached or key in missing or key in waiting:
+            continue
+        if key in lemmas_in_flight:
+            # Этот текст уже лемматизирует другой запрос: дождёмся его результата
+            waiting[key] = lemmas_in_flight[key]
+        else:
+            missing[key] = content
+    if missing:
+        # Лемматизация идёт отдельной задачей: отмена запроса, который её начал, не прерывает
+        # её для других запросов, ожидающих те же тексты
+        task = asyncio.create_task(lemmatize_missing(missing))
+        for key in missing:
+            lemmas_in_flight[key] = task
+            waiting[key] = task
+        task.add_done_callback(lambda done, keys=list(missing): _release_in_flight(done, keys))
+    for key, task in waiting.items():
+        cached[key] = (await asyncio.shield(task))[key]
+    logger.info(f"Lemma cache: {len(contents) - len(missing)} hits, {len(missing)} misses")
+    return [remove_stop_words(cached[key]) for key in keys]
+
+
+async def get_median_lemmatized_word_frequency(contents):
+    results = await get_lemmatized_words(contents)
+    return median_frequencies(results)
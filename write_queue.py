@@ -0,0 +1,306 @@
+import asyncio
+import fcntl
+import itertools
+import os
+import pickle
+import time
+
+from config import (WRITE_BEHIND_ENABLED, WRITE_BEHIND_INTERVAL, WRITE_BEHIND_MAX_ROWS, WRITE_BEHIND_MAX_PENDING_ROWS,
+                    WRITE_BEHIND_MAX_BACKOFF, WRITE_SPOOL_ENABLED, WRITE_SPOOL_DIR, WRITE_SPOOL_INTERVAL)
+from db_utils import merge_request_artifacts, SpooledBatch
+from logger import logger
+
+
+class WriteBehindQueue:
+    """Копит строки запросов в памяти и периодически сохраняет их одной транзакцией.
+
+    Пока база недоступна, повторы записи идут с растущей паузой, а в памяти держится
+    не больше max_pending_rows строк: самые старые запросы сверх этого отбрасываются.
+    """
+
+    def __init__(self, interval: float, max_rows: int, max_pending_rows: int, max_backoff: float):
+        self.interval = interval
+        self.max_rows = max_rows
+        self.max_pending_rows = max_pending_rows
+        self.max_backoff = max_backoff
+        self._database = None
+        self._pending = []
+        self._pending_rows = 0
+        self._task = None
+        self._wakeup = None
+        self._flush_lock = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self.failed_flushes = 0
+        self.dropped_rows = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self, database):
+        if self._task is not None:
+            return
+        self._database = database
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Write-behind queue started: interval={self.interval}s, max_rows={self.max_rows}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        # Всё накопленное сохраняем до остановки приложения
+        await self.flush()
+        logger.info("Write-behind queue stopped")
+
+    def put(self, artifacts: dict):
+        self._pending.append(artifacts)
+        self._pending_rows += self._count_rows(artifacts)
+        self._trim()
+        if self._pending_rows >= self.max_rows:
+            self._wakeup.set()
+
+    @staticmethod
+    def _count_rows(artifacts: dict) -> int:
+        return sum(len(rows) for rows in artifacts.values())
+
+    def _trim(self):
+        # Последний запрос сохраняем всегда, даже если он один больше предела
+        dropped = 0
+        while self._pending_rows > self.max_pending_rows and len(self._pending) > 1:
+            rows = self._count_rows(self._pending.pop(0))
+            self._pending_rows -= rows
+            dropped += rows
+        if dropped:
+            self.dropped_rows += dropped
+            logger.error(f"Write-behind queue is full, {dropped} oldest rows dropped")
+
+    def stats(self) -> dict:
+        return {"pending_rows": self._pending_rows, "failed_flushes": self.failed_flushes,
+                "dropped_rows": self.dropped_rows}
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batches, self._pending = self._pending, []
+            rows, self._pending_rows = self._pending_rows, 0
+            try:
+                await self._database.save_artifacts(merge_request_artifacts(batches))
+                self._failures = 0
+                logger.info(f"Write-behind flush: {len(batches)} requests, {rows} rows")
+            except Exception as e:
+                # Возвращаем строки в очередь и повторяем запись после паузы, удваивающейся с каждой ошибкой
+                self._failures += 1
+                self.failed_flushes += 1
+                backoff = min(self.max_backoff, self.interval * 2 ** self._failures)
+                self._retry_at = asyncio.get_running_loop().time() + backoff
+                logger.error(f"Write-behind flush failed, {rows} rows will be retried in {backoff:.0f}s: {e}")
+                self._pending = batches + self._pending
+                self._pending_rows += rows
+                self._trim()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = self._retry_at - loop.time()
+            if delay > 0:
+                # После ошибки записи ждём паузу целиком, заполнение очереди её не прерывает
+                await asyncio.sleep(delay)
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            await self.flush()
+
+
+class SpoolWriter:
+    """Очередь записи на диске для режима с несколькими воркерами.
+
+    Каждый воркер кладёт строки запроса файлом в каталог очереди, а записывает их в БД только
+    один процесс — владелец блокировки writer.lock. Остальные периодически пробуют её захватить,
+    поэтому после остановки владельца запись продолжает другой воркер. on_acquire вызывается
+    каждый раз, когда процесс становится владельцем.
+    """
+
+    LOCK_NAME = "writer.lock"
+    SUFFIX = ".artifacts"
+
+    def __init__(self, path: str, interval: float, max_rows: int):
+        self.path = path
+        self.interval = interval
+        self.max_rows = max_rows
+        self._database = None
+        self._on_acquire = None
+        self._lock_file = None
+        self._task = None
+        self._counter = itertools.count()
+        self.spooled = 0
+        self.written = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    @property
+    def is_writer(self) -> bool:
+        return self._lock_file is not None
+
+    def _try_acquire(self) -> bool:
+        if self._lock_file is not None:
+            return True
+        lock_file = open(os.path.join(self.path, self.LOCK_NAME), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        logger.info(f"Process {os.getpid()} is the database writer")
+        return True
+
+    async def _acquire(self) -> bool:
+        was_writer = self.is_writer
+        if not self._try_acquire():
+            return False
+        if not was_writer and self._on_acquire is not None:
+            try:
+                await self._on_acquire()
+            except Exception as e:
+                logger.error(f"Write spool acquire callback failed: {e}")
+        return True
+
+    def _release(self):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    async def start(self, database, on_acquire=None):
+        if self._task is not None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        self._database = database
+        self._on_acquire = on_acquire
+        await self._acquire()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Write spool started: {self.path}, writer={self.is_writer}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        if self.is_writer:
+            # Сохраняем всё, что успели положить в очередь, и передаём запись другому воркеру
+            await self.drain()
+            self._release()
+        logger.info("Write spool stopped")
+
+    def _write_file(self, artifacts: dict):
+        name = f"{time.time_ns()}-{os.getpid()}-{next(self._counter)}"
+        tmp_path = os.path.join(self.path, name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(artifacts, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # Файл появляется под итоговым именем только целиком, владелец не прочтёт его наполовину
+        os.replace(tmp_path, os.path.join(self.path, name + self.SUFFIX))
+
+    async def put(self, artifacts: dict):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_file, artifacts)
+        self.spooled += 1
+
+    def _read_batch(self, written: set = frozenset()):
+        names = sorted(name for name in os.listdir(self.path) if name.endswith(self.SUFFIX))
+        paths, batches, rows = [], [], 0
+        for name in names:
+            if name in written:
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                with open(path, "rb") as f:
+                    artifacts = pickle.load(f)
+            except (pickle.UnpicklingError, EOFError) as e:
+                # Повреждённый файл откладываем в сторону, иначе он остановит всю очередь
+                logger.error(f"Write spool file {name} is corrupted and skipped: {e}")
+                os.replace(path, path + ".bad")
+                continue
+            paths.append(path)
+            # Имя файла сохраняется в той же транзакции, что и его строки
+            batches.append(dict(artifacts, **{SpooledBatch.__tablename__: [{'name': name}]}))
+            rows += sum(len(table_rows) for table_rows in artifacts.values())
+            if rows >= self.max_rows:
+                break
+        return paths, batches, rows
+
+    def _remove(self, names):
+        for name in names:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+    async def drain(self):
+        """Записывает файлы очереди в БД транзакциями не больше max_rows строк.
+
+        Файл удаляется после записи его строк; если процесс остановился между записью и удалением,
+        файл уже отмечен в spool_batches и при следующем проходе удаляется без повторной записи.
+        """
+        loop = asyncio.get_running_loop()
+        names = sorted(name for name in os.listdir(self.path) if name.endswith(self.SUFFIX))
+        written = await self._database.get_spooled_batches(names) if names else set()
+        if written:
+            logger.warning(f"Write spool: {len(written)} files were already written, removing")
+            await loop.run_in_executor(None, self._remove, written)
+        while True:
+            paths, batches, rows = await loop.run_in_executor(None, self._read_batch, written)
+            if not batches:
+                return
+            await self._database.save_artifacts(merge_request_artifacts(batches))
+            written.update(os.path.basename(path) for path in paths)
+            await loop.run_in_executor(None, self._remove, [os.path.basename(path) for path in paths])
+            self.written += len(batches)
+            logger.info(f"Write spool flush: {len(batches)} requests, {rows} rows")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not await self._acquire():
+                continue
+            try:
+                await self.drain()
+            except Exception as e:
+                # Файлы остаются в каталоге и будут записаны при следующей попытке
+                logger.error(f"Write spool flush failed: {e}")
+
+    def stats(self) -> dict:
+        return {"writer": int(self.is_writer), "spooled": self.spooled, "written": self.written}
+
+
+write_queue = WriteBehindQueue(WRITE_BEHIND_INTERVAL, WRITE_BEHIND_MAX_ROWS, WRITE_BEHIND_MAX_PENDING_ROWS,
+                               WRITE_BEHIND_MAX_BACKOFF)
+write_spool = SpoolWriter(WRITE_SPOOL_DIR, WRITE_SPOOL_INTERVAL, WRITE_BEHIND_MAX_ROWS)
+
+
+async def persist_request_artifacts(database, artifacts: dict):
+    """Сохраняет строки запроса сразу одной транзакцией, через очередь отложенной записи
+    или, при нескольких воркерах, через общую очередь на диске с одним процессом-писателем."""
+    if WRITE_SPOOL_ENABLED and write_spool.running:
+        await write_spool.put(artifacts)
+    elif WRITE_BEHIND_ENABLED and write_queue.running:
+        write_queue.put(artifacts)
+    else:
+        await database.save_artifacts(artifacts)